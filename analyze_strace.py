@@ -3,6 +3,7 @@ import re
 import datetime
 import pprint
 from argparse import ArgumentParser, REMAINDER
+from fileutils import openInput
 
 year = 2013
 month = 4
@@ -91,7 +92,7 @@ ops = []
 op = {}
 stats = {'funcs': {}}
 for fn in args.files:
-    f = file(fn)
+    f = openInput(fn)
     prevsec = -1
     prevmsec = -1
     for line in f:
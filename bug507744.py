@@ -1,5 +1,5 @@
 from bug_harness import DSAdminHarness as DSAdmin
-from dsadmin import Entry
+from dsadmin import Entry, waitForEntries
 
 
 import os
@@ -142,27 +142,9 @@ for (ii, mmx) in enumerate(srvs):
     ent = Entry(dn)
     ent.setValues("objectclass", "extensibleObject")
     mmx.add_s(ent)
-    time.sleep(2)
-    for mmy in srvs:
-        while True:
-            try: ents = mmy.search_s(dn, ldap.SCOPE_BASE)
-            except ldap.NO_SUCH_OBJECT: ents = []
-            if len(ents) < 1:
-                print "waiting for", dn, "on", str(mmy)
-                time.sleep(1)
-            elif ents[0]:
-                print "found", dn, "on", str(mmy)
-                break
+    waitForEntries(srvs, [dn], quiet=False)
     mmx.delete_s(dn)
-    time.sleep(2)
-    for mmy in srvs:
-        while True:
-            try: ents = mmy.search_s(dn, ldap.SCOPE_BASE)
-            except ldap.NO_SUCH_OBJECT:
-                print dn, "was deleted on", str(mmy)
-                break
-            print "waiting for delete of", dn, "on", str(mmy)
-            time.sleep(1)
+    waitForEntries(srvs, [dn], gone=True, quiet=False)
 
 binattr = "userCertificate;binary"
 binval = ''.join([chr(ii % 256) for ii in xrange(0, 4096)])
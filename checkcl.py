@@ -4,7 +4,11 @@ import sys
 import string
 import ldif
 import re
-from bisect import insort
+from array import array
+from fileutils import openInput
+from csnutils import CSN, CSNArray, HASNUMPY, RID_MASK, mergeunique
+if HASNUMPY:
+  import numpy
 
 # we want to find out if
 # * all csns in one server are in the other servers
@@ -15,49 +19,28 @@ from bisect import insort
 #    what order the entries were added in, such
 #    as cn=1, cn=2, etc.
 
-class CSN:
-  USE_RID = True
-  def __init__(self,csnstr):
-    self.ts = int(csnstr[:8], 16)
-    self.seq = int(csnstr[8:12], 16)
-    self.rid = int(csnstr[12:16])
-  def __str__(self):
-    return "%08x%04x%04x0000" % (self.ts, self.seq, self.rid)
-  __repr__ = __str__
-  def __cmp__(self, oth):
-    ret = self.ts - oth.ts
-    if not ret:
-      ret = self.seq - oth.seq
-      if not ret and CSN.USE_RID:
-        ret = self.rid - oth.rid
-    return ret
-  def __lt__(self, oth): return self.__cmp__(oth) < 0
-  def __le__(self, oth): return self.__cmp__(oth) <= 0
-  def __gt__(self, oth): return self.__cmp__(oth) > 0
-  def __ge__(self, oth): return self.__cmp__(oth) >= 0
-  def __eq__(self, oth): return self.__cmp__(oth) == 0
-  def __ne__(self, oth): return self.__cmp__(oth) != 0
-  def __hash__(self): # use a CSN as a hash key
-    if CSN.USE_RID:
-      return (self.ts << 32) | (self.seq << 16) | self.rid
-    else:
-      return (self.ts << 16) | self.seq
-
 # Can't use ldif.LDIFParser.parse - the cl.ldif
 # files are not well-formed - have to use copypasta
 class CLDB(ldif.LDIFParser):
+  """The CSNs of a changelog LDIF file.  Each record is appended to
+  typed arrays - csn, cn value and changetype - instead of keeping
+  objects, and the arrays are sorted once after the whole file is read:
+  self.sortedcsns has all of the CSNs in order, and self.unique has them
+  without duplicates."""
   cnpat = re.compile(r'cn=([\d]+),')
 
   def __init__(self,input_file):
-    myfile = open(input_file, "r")
-    self.csns = {} # key is csn string, value is (dn, changetype, CSN()) tuple
-    self.byrid = {} # key is rid - value is hash
-    # key is changetype - value is tuple (cn, CSN())
+    myfile = openInput(input_file)
+    self.csnarr = CSNArray() # csn of each record
+    self.cns = array('l') # cn value of each record, -1 if none
+    self.ctypes = array('B') # index into self.ctypenames of each record
+    self.ctypenames = []
     ldif.LDIFParser.__init__(self,myfile)
     self.parse()
     myfile.close()
     self.name = input_file
-    # create the list of 
+    self.sortedcsns = self.csnarr.sorted()
+    self.unique = self.sortedcsns.unique()
 
   def parse(self):
     """
@@ -119,7 +102,7 @@ class CLDB(ldif.LDIFParser):
   # parse() calls handle for each entry read
   def handle(self,dn,entry):
     """
-    Append single record to dictionary of all records.
+    Append the csn, cn and changetype of a record to the arrays.
     """
     changetype = None
     if entry.has_key('changetype'):
@@ -128,90 +111,150 @@ class CLDB(ldif.LDIFParser):
     if dn and CLDB.cnpat.match(dn):
       cnval = int(CLDB.cnpat.match(dn).group(1))
 #    print "CLDB.handle: dn", dn, " changetype", changetype, " cn", cnval
-    if entry.has_key('csn'):      
-      csnstr = entry['csn'][0]
-      csn = CSN(csnstr)
-      tup = (dn, changetype, csn)
-      if self.csns.has_key(csn):
-        print "Error: entry %s has dup csn %s" % (dn, csnstr)
-        print "existing records:", self.csns[csn]
-        self.csns[csn].append(tup)
-      else:
-        self.csns[csn] = [tup]
-      if not self.byrid.has_key(csn.rid):
-        self.byrid[csn.rid] = {changetype: {'ary': [], 'hash': {}}}
-      if not self.byrid[csn.rid].has_key(changetype):
-        self.byrid[csn.rid][changetype] = {'ary': [], 'hash': {}}
-      insort(self.byrid[csn.rid][changetype]['ary'], cnval)
-      self.byrid[csn.rid][changetype]['hash'][cnval] = csn
+    if entry.has_key('csn'):
+      if changetype not in self.ctypenames:
+        self.ctypenames.append(changetype)
+      self.csnarr.append(entry['csn'][0])
+      self.cns.append(cnval)
+      self.ctypes.append(self.ctypenames.index(changetype))
     else:
       print "entry", dn, " has no csn"
 
+  def findDuplicates(self):
+    """a csn used by more than one record - adjacent in the sorted csns"""
+    dups = self.sortedcsns.duplicates()
+    if not len(dups):
+      return
+    dupset = set(dups.buf)
+    recs = {}
+    for ii, val in enumerate(self.csnarr.buf):
+      if val in dupset:
+        recs.setdefault(val, []).append((self.cns[ii], self.ctypenames[self.ctypes[ii]]))
+    for csn in dups:
+      print "Error: dup csn %s used by records (cn, changetype) %s" % (csn.csnstr(), recs[csn])
+
   def findOutOfOrder(self):
-    for (rid, byctype) in self.byrid.iteritems():
-      for (ctype, ahhash) in byctype.iteritems():
+    """for each rid and changetype, the csns in cn order should be in
+    order too (ignoring the rid) - sort the records by (rid, changetype,
+    cn) once and compare each csn with the one before it"""
+    if HASNUMPY:
+      vals = self.csnarr.values()
+      cns = numpy.frombuffer(self.cns, dtype='i%d' % self.cns.itemsize)
+      ctypes = numpy.frombuffer(self.ctypes, dtype=numpy.uint8)
+      rids = vals & numpy.uint64(0xffff)
+      order = numpy.lexsort((cns, ctypes, rids))
+      tsseq = vals[order] >> numpy.uint64(16)
+      samegroup = (rids[order][1:] == rids[order][:-1]) & \
+                  (ctypes[order][1:] == ctypes[order][:-1])
+      for pos in numpy.nonzero(samegroup & (tsseq[1:] < tsseq[:-1]))[0]:
+        ii = order[pos + 1]
+        print "Error: csn", self.csnarr[ii].csnstr(), " for cn", cns[ii], " is out of order"
+      return
+    buf = self.csnarr.buf
+    order = sorted(xrange(len(buf)),
+                   key=lambda ii: (buf[ii] & 0xffff, self.ctypes[ii], self.cns[ii]))
+    lastkey = None
+    lastcsn = None
+    for ii in order:
+      csn = self.csnarr[ii]
+      key = (csn.rid, self.ctypes[ii])
+      if key != lastkey:
         lastcsn = None
-        for cn in ahhash['ary']:
-          csn = ahhash['hash'][cn]
-#          print "rid=", rid, " ctype-", ctype, "cn=", cn, "csn =", csn
-          CSN.USE_RID = False # ignore rid for comparison
-          if lastcsn and csn < lastcsn:
-            print "Error: csn", csn, " for cn", cn, " is out of order"
-          lastcsn = csn
-          CSN.USE_RID = True # reset
+        lastkey = key
+#      print "rid=", csn.rid, " ctype-", self.ctypenames[self.ctypes[ii]], "cn=", self.cns[ii], "csn =", csn
+      # ignore rid for comparison
+      if lastcsn and csn.tsseq < lastcsn.tsseq:
+        print "Error: csn", csn.csnstr(), " for cn", self.cns[ii], " is out of order"
+      lastcsn = csn
+
+  def reportMissing(self,oth,verbose=False):
+    """print the csns in self that are not in oth - a merge of the two
+    sorted unique csn arrays"""
+    missing = self.unique.sorteddiff(oth.unique)
+    nmissing = len(missing)
+    if verbose:
+      for csn in missing:
+        print "Error:", oth.name, "is missing CSN", csn.csnstr()
+    print "Changelog", self.name, "has", len(self.unique), " csns"
+    if nmissing > 0:
+      print "Server", oth.name, "is missing", nmissing, "csns - min", missing[0].csnstr(), "max", missing[-1].csnstr()
 
   def checkCSNs(self,oth,verbose=False):
     # see if there are any csns in self that are not present
     # in oth
     # see if there are any csns in oth that are not present
     # in self
-    ii = 0
-    nmissing = 0
-    mincsn = None
-    maxcsn = None
-    for csn in self.csns.iterkeys():
-      ii = ii + 1
-      if not oth.csns.has_key(csn):
-        nmissing = nmissing + 1
-        if verbose: print "Error:", oth.name, "is missing CSN", csn
-        if not mincsn:
-          mincsn = csn
-        if not maxcsn:
-          maxcsn = csn
-        if csn < mincsn:
-          mincsn = csn
-        if csn > maxcsn:
-          maxcsn = csn
-    print "Changelog", self.name, "has", ii, " csns"
-    if nmissing > 0:
-      print "Server", oth.name, "is missing", nmissing, "csns - min", mincsn, "max", maxcsn
-    ii = 0
-    nmissing = 0
-    mincsn = None
-    maxcsn = None
-    for csn in oth.csns.iterkeys():
-      ii = ii + 1
-      if not self.csns.has_key(csn):
-        nmissing = nmissing + 1
-        if verbose: print "Error:", self.name, "is missing CSN", csn
-        if not mincsn:
-          mincsn = csn
-        if not maxcsn:
-          maxcsn = csn
-        if csn < mincsn:
-          mincsn = csn
-        if csn > maxcsn:
-          maxcsn = csn
-    print "Changelog", oth.name, "has", ii, " csns"
-    if nmissing > 0:
-      print "Server", self.name, "is missing", nmissing, "csns - min", mincsn, "max", maxcsn
+    self.reportMissing(oth, verbose)
+    oth.reportMissing(self, verbose)
+
+def compareAll(cldbs,verbose=False):
+  """compare all of the changelogs in one k-way merge of their sorted
+  unique csns - for each changelog print the csns it is missing that
+  others have, as runs of consecutive csns of the same rid [min, max].
+  A run ends when the changelog has the next csn of that rid."""
+  nn = len(cldbs)
+  openruns = {} # rid -> {changelog index: [min, max, count]}
+  missing = [{} for cldb in cldbs] # rid -> list of [min, max, count]
+  total = 0
+  for val, have in mergeunique([cldb.unique for cldb in cldbs]):
+    total += 1
+    rid = val & RID_MASK
+    runs = openruns.get(rid)
+    if runs:
+      for ii in have:
+        if ii in runs:
+          del runs[ii]
+    if len(have) == nn:
+      continue
+    if runs is None:
+      runs = openruns[rid] = {}
+    for ii in range(nn):
+      if ii in have:
+        continue
+      run = runs.get(ii)
+      if run is None:
+        run = runs[ii] = [val, val, 0]
+        missing[ii].setdefault(rid, []).append(run)
+      run[1] = val
+      run[2] += 1
+  print "Compared %d changelogs - %d distinct csns" % (nn, total)
+  for cldb, byrid in zip(cldbs, missing):
+    print "Changelog", cldb.name, "has", len(cldb.unique), " csns"
+    nmissing = sum([run[2] for runs in byrid.values() for run in runs])
+    if not nmissing:
+      continue
+    print "Server", cldb.name, "is missing", nmissing, "csns"
+    for rid in sorted(byrid):
+      runs = byrid[rid]
+      print "  rid %d: %d csns in %d runs" % (rid, sum([run[2] for run in runs]), len(runs))
+      if verbose:
+        for first, last, count in runs:
+          print "    [%s, %s] %d csns" % (CSN(first).csnstr(), CSN(last).csnstr(), count)
+
+# checkcl.py [-p] [-v] cl1.ldif cl2.ldif ...
+# -p compares each pair of changelogs instead of all of them at once
+# -v prints every missing run (every missing csn with -p)
+pairwise = False
+verbose = False
+files = []
+for arg in sys.argv[1:]:
+  if arg == '-p':
+    pairwise = True
+  elif arg == '-v':
+    verbose = True
+  else:
+    files.append(arg)
 
-print "Reading in %d changelog LDIF files . . ." % len(sys.argv[1:])
+print "Reading in %d changelog LDIF files . . ." % len(files)
 cldbs = []
-for f in sys.argv[1:]:
+for f in files:
     cldb = CLDB(f)
     cldbs.append(cldb)
     print "Read in changelog", cldb.name
+    cldb.findDuplicates()
     cldb.findOutOfOrder()
-    for oth in cldbs[:-1]:
-      cldb.checkCSNs(oth)
+    if pairwise:
+      for oth in cldbs[:-1]:
+        cldb.checkCSNs(oth, verbose)
+if not pairwise and len(cldbs) > 1:
+  compareAll(cldbs, verbose)
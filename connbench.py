@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Measure the time from DSAdmin() to the end of the first operation (a
+base search of the root DSE) for one or more servers.
+
+    connbench.py [-n 5] [-D binddn] [-w password] [--nocache] host:port ...
+
+With --nocache the isLocalHost and instance info caches are cleared before
+each connection, which is the cost of the first connection to a server -
+compare with the default to see the effect of the caches."""
+
+import sys
+import time
+import ldap
+from argparse import ArgumentParser
+from dsadmin import DSAdmin, isLocalHost
+
+
+def connect(host, port, binddn, bindpw, nocache):
+    if nocache:
+        DSAdmin.clearInstCache()
+        isLocalHost.cache.clear()
+    start = time.time()
+    conn = DSAdmin(host, port, binddn, bindpw)
+    constructed = time.time()
+    conn.search_s('', ldap.SCOPE_BASE, '(objectclass=*)', ['1.1'])
+    done = time.time()
+    conn.unbind_s()
+    return constructed - start, done - start
+
+
+parser = ArgumentParser()
+parser.add_argument('servers', nargs='+', help='host:port of the servers to connect to')
+parser.add_argument('-n', type=int, default=5, help='number of times to connect to each server')
+parser.add_argument('-D', dest='binddn', default='cn=directory manager')
+parser.add_argument('-w', dest='bindpw', default='password')
+parser.add_argument('--nocache', action='store_true', help='clear the caches before each connection')
+args = parser.parse_args()
+
+print "%-30s %10s %10s %10s %10s" % ('server', 'init avg', 'first avg', 'first min', 'first max')
+alltimes = []
+for server in args.servers:
+    host, port = server.split(':')
+    times = [connect(host, int(port), args.binddn, args.bindpw, args.nocache)
+             for ii in xrange(args.n)]
+    alltimes.extend(times)
+    firsts = [tt[1] for tt in times]
+    print "%-30s %10.4f %10.4f %10.4f %10.4f" % (
+        server, sum([tt[0] for tt in times]) / len(times),
+        sum(firsts) / len(firsts), min(firsts), max(firsts))
+total = sum([tt[1] for tt in alltimes])
+print "%d connections in %.3f seconds - %.4f seconds to first operation" % (
+    len(alltimes), total, total / len(alltimes))
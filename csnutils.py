@@ -0,0 +1,268 @@
+"""CSN (Change Sequence Number) utilities that only need the standard
+library - NumPy is used by CSNArray if it is installed.  Used by dsadmin
+(RUVs) and checkcl (changelogs).
+
+    CSN - a CSN packed into an integer, ordered by ts, seq, rid
+    CSNArray - a compact sortable container of many CSNs
+    mergeunique - k-way merge of many sorted CSNArrays
+"""
+import time
+import datetime
+import heapq
+from array import array
+try:
+    import numpy
+    HASNUMPY = True
+except ImportError:
+    HASNUMPY = False
+
+# array type code of an unsigned 64 bit integer - None if there is none
+# (e.g. 32 bit python 2), in which case CSNArray uses a list
+CSN_TYPECODE = None
+for code in ('L', 'Q'):
+    try:
+        if array(code).itemsize == 8:
+            CSN_TYPECODE = code
+            break
+    except ValueError:
+        pass
+
+RID_MASK = 0xffff
+
+
+class CSN(long):
+    """CSN is Change Sequence Number
+        csn.ts is the timestamp (time_t - seconds)
+        csn.seq is the sequence number (max 65535)
+        csn.rid is the replica ID of the originating master
+        csn.subseq is not currently used (always 0)
+    The CSN is an integer ts << 32 | seq << 16 | rid, so CSNs compare,
+    sort and hash as integers - the first 16 hex digits of the CSN
+    string are that integer.  csn.tsseq is the CSN without the rid, for
+    comparing the order of changes from different replicas."""
+    __slots__ = ()
+
+    def __new__(cls, csn=0):
+        if isinstance(csn, basestring):
+            try:
+                val = int(csn[:16], 16)
+                if len(csn) < 16:
+                    raise ValueError(csn)
+            except ValueError:
+                if csn:
+                    print csn, "is not a valid CSN"
+                val = 0
+            return long.__new__(cls, val)
+        return long.__new__(cls, csn)
+
+    @staticmethod
+    def pack(ts, seq, rid):
+        return CSN((ts << 32) | (seq << 16) | rid)
+
+    ts = property(lambda self: int(self >> 32))
+    seq = property(lambda self: int((self >> 16) & 0xffff))
+    rid = property(lambda self: int(self & RID_MASK))
+    subseq = property(lambda self: 0)
+    tsseq = property(lambda self: self >> 16)
+
+    def csndiff(self, oth):
+        return (oth.ts - self.ts, oth.seq - self.seq, oth.rid - self.rid, oth.subseq - self.subseq)
+
+    def diff2str(self, oth):
+        retstr = ''
+        diff = oth.ts - self.ts
+        if diff > 0:
+            td = datetime.timedelta(seconds=diff)
+            retstr = "is behind by %s" % td
+        elif diff < 0:
+            td = datetime.timedelta(seconds=-diff)
+            retstr = "is ahead by %s" % td
+        else:
+            diff = oth.seq - self.seq
+            if diff:
+                retstr = "seq differs by %d" % diff
+            elif self.rid != oth.rid:
+                retstr = "rid %d not equal to rid %d" % (self.rid, oth.rid)
+            else:
+                retstr = "equal"
+        return retstr
+
+    def csnstr(self):
+        """the CSN string e.g. 4f5a3b2c000100030000"""
+        return "%016x0000" % self
+
+    def __repr__(self):
+        return time.strftime("%x %X", time.localtime(self.ts)) + " seq: " + str(self.seq) + " rid: " + str(self.rid)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class CSNArray(object):
+    """An array of CSNs stored as 64 bit integers instead of objects -
+    millions of CSNs take 8 bytes each.  append/extend add CSNs (CSN
+    objects, integers or CSN strings).  The other operations return new
+    CSNArrays, or dicts of them, and use NumPy if it is installed:
+
+        sorted() - in CSN order
+        unique() - sorted, without duplicates
+        duplicates() - sorted, the CSNs that are in the array more than once
+        difference(oth) - sorted, the unique CSNs that are not in oth
+        sorteddiff(oth) - the same, for arrays that are sorted and unique
+        byrid() - dict of rid -> the CSNs of that rid, in the array order
+
+    Iterating or indexing gives CSN objects."""
+
+    def __init__(self, csns=()):
+        if CSN_TYPECODE:
+            self.buf = array(CSN_TYPECODE)
+        else:
+            self.buf = []
+        self.extend(csns)
+
+    @staticmethod
+    def fromvalues(vals):
+        """make a CSNArray from a NumPy array or a list of integers"""
+        ret = CSNArray()
+        if HASNUMPY and isinstance(vals, numpy.ndarray):
+            if CSN_TYPECODE:
+                ret.buf.fromstring(vals.astype(numpy.uint64).tostring())
+                return ret
+            vals = vals.tolist()
+        ret.buf.extend(vals)
+        return ret
+
+    def values(self):
+        """the CSNs as a NumPy uint64 array if NumPy is installed, or as
+        a list of integers"""
+        if HASNUMPY:
+            if CSN_TYPECODE:
+                return numpy.frombuffer(self.buf, dtype=numpy.uint64)
+            return numpy.array(self.buf, dtype=numpy.uint64)
+        return list(self.buf)
+
+    def append(self, csn):
+        if isinstance(csn, basestring):
+            csn = CSN(csn)
+        self.buf.append(csn)
+
+    def extend(self, csns):
+        for csn in csns:
+            self.append(csn)
+
+    def __len__(self):
+        return len(self.buf)
+
+    def __getitem__(self, ii):
+        return CSN(self.buf[ii])
+
+    def __iter__(self):
+        for val in self.buf:
+            yield CSN(val)
+
+    def __repr__(self):
+        return "CSNArray(%d csns)" % len(self)
+
+    def sorted(self):
+        if HASNUMPY:
+            return CSNArray.fromvalues(numpy.sort(self.values()))
+        return CSNArray.fromvalues(sorted(self.buf))
+
+    def unique(self):
+        if HASNUMPY:
+            return CSNArray.fromvalues(numpy.unique(self.values()))
+        return CSNArray.fromvalues(sorted(set(self.buf)))
+
+    def duplicates(self):
+        if HASNUMPY:
+            vals = numpy.sort(self.values())
+            dups = vals[1:][vals[1:] == vals[:-1]]
+            return CSNArray.fromvalues(numpy.unique(dups))
+        seen = set()
+        dups = set()
+        for val in self.buf:
+            if val in seen:
+                dups.add(val)
+            seen.add(val)
+        return CSNArray.fromvalues(sorted(dups))
+
+    def difference(self, oth):
+        if HASNUMPY:
+            return CSNArray.fromvalues(numpy.setdiff1d(self.values(), oth.values()))
+        othset = set(oth.buf)
+        return CSNArray.fromvalues(sorted(set([val for val in self.buf if val not in othset])))
+
+    def sorteddiff(self, oth):
+        """like difference, for when self and oth are both already sorted
+        and unique - a single merge pass instead of sorting again"""
+        if HASNUMPY:
+            vals, othvals = self.values(), oth.values()
+            if not len(othvals):
+                return CSNArray.fromvalues(vals)
+            idx = numpy.searchsorted(othvals, vals)
+            found = othvals[numpy.minimum(idx, len(othvals) - 1)] == vals
+            return CSNArray.fromvalues(vals[~found])
+        ret = CSNArray()
+        othbuf = oth.buf
+        nn = len(othbuf)
+        jj = 0
+        for val in self.buf:
+            while jj < nn and othbuf[jj] < val:
+                jj += 1
+            if jj == nn or othbuf[jj] != val:
+                ret.buf.append(val)
+        return ret
+
+    def rids(self):
+        """the sorted list of replica IDs in the array"""
+        if HASNUMPY:
+            return [int(rid) for rid in numpy.unique(self.values() & numpy.uint64(RID_MASK))]
+        return sorted(set([int(val & RID_MASK) for val in self.buf]))
+
+    def byrid(self):
+        ret = {}
+        if HASNUMPY:
+            vals = self.values()
+            rids = vals & numpy.uint64(RID_MASK)
+            for rid in numpy.unique(rids):
+                ret[int(rid)] = CSNArray.fromvalues(vals[rids == rid])
+            return ret
+        for val in self.buf:
+            rid = int(val & RID_MASK)
+            if rid not in ret:
+                ret[rid] = CSNArray()
+            ret[rid].buf.append(val)
+        return ret
+
+
+def mergeunique(arrays):
+    """k-way merge of sorted, unique CSNArrays (e.g. from unique()) -
+    yield each CSN in any of them, in order, as (integer, list of the
+    indexes of the arrays that have it).  One pass over all of the arrays
+    together, instead of comparing each pair of them.  The heap holds
+    the next (CSN, index, iterator) of each array - heapq.merge would do,
+    but it is new in python 2.6."""
+    heap = []
+    for ii, arr in enumerate(arrays):
+        it = iter(arr.buf)
+        for val in it:
+            heap.append((val, ii, it))
+            break
+    heapq.heapify(heap)
+    last = None
+    have = []
+    while heap:
+        val, ii, it = heap[0]
+        if val != last:
+            if have:
+                yield last, have
+            last = val
+            have = []
+        have.append(ii)
+        for val in it:
+            heapq.heapreplace(heap, (val, ii, it))
+            break
+        else:
+            heapq.heappop(heap)
+    if have:
+        yield last, have
@@ -12,13 +12,16 @@ try:
 except ImportError:
     import popen2
     HASPOPEN = False
-    
+try:
+    import multiprocessing
+    HASMP = True
+except ImportError:
+    HASMP = False
+
 import sys
 import os
 import os.path
 import base64
-import urllib
-import urllib2
 import socket
 import ldif
 import re
@@ -27,14 +30,19 @@ import cStringIO
 import time
 import operator
 import shutil
-import datetime
 import select
+import threading
+import anydbm
+import tempfile
+from collections import deque
 
 from ldap.ldapobject import SimpleLDAPObject
 from ldapurl import LDAPUrl
 from ldap.cidict import cidict
 
 from dsadmin_utils import *
+from fileutils import openInput, compression, LogFollower
+from csnutils import CSN, CSNArray
 
 
 # replicatype @see https://access.redhat.com/knowledge/docs/en-US/Red_Hat_Directory_Server/8.1/html/Administration_Guide/Managing_Replication-Configuring-Replication-cmd.html
@@ -49,7 +57,7 @@ REPLICA_RDONLY_TYPE = 2  # CONSUMER and HUB
 REPLICA_WRONLY_TYPE = 1  # SINGLE and MULTI MASTER
 REPLICA_RDWR_TYPE = REPLICA_RDONLY_TYPE | REPLICA_WRONLY_TYPE
 
-DBMONATTRRE = re.compile(r'^([a-zA-Z]+)-([1-9][0-9]*)$')
+DBMONATTRRE = re.compile(r'^([a-zA-Z]+)-([0-9]+)$')
 DBMONATTRRESUN = re.compile(r'^([a-zA-Z]+)-([a-zA-Z]+)$')
 
 # Some DN constants
@@ -58,6 +66,31 @@ DN_LDBM = "cn=ldbm database,cn=plugins,cn=config"
 DN_MAPPING_TREE = "cn=mapping tree,cn=config"
 DN_CHAIN = "cn=chaining database,cn=plugins,cn=config"
 
+# the RUV tombstone entry of a replicated suffix
+RUV_FILTER = "(&(nsUniqueID=ffffffff-ffffffff-ffffffff-ffffffff)(objectclass=nsTombstone))"
+RUV_ATTRS = ['nsds50ruv', 'nsruvReplicaLastModified']
+
+# entries read into a ConfigSnapshot
+CONFIG_SNAPSHOT_FILTER = "(|(objectclass=nsBackendInstance)(objectclass=nsMappingTree)" \
+    "(objectclass=nsds5Replica)(objectclass=nsds5ReplicationAgreement)(objectclass=nsIndex))"
+# how often DSAdmin checks that its ConfigSnapshot is still current
+CONFIG_SNAPSHOT_CHECK_INTERVAL = 10
+# the subtrees a ConfigSnapshot is read from - writes under these
+# invalidate it, other writes under cn=config (e.g. tasks) do not
+CONFIG_SNAPSHOT_BASES = (DN_MAPPING_TREE, DN_LDBM, DN_CHAIN)
+
+# longest time serverCmd waits between checks of the errors log and the
+# LDAP port when nothing is written to the log
+SERVERCMD_PROBE_INTERVAL = 0.5
+# serverCmd start only probes the server once the errors log has been quiet
+# for this many seconds (or was rotated or is missing)
+SERVERCMD_QUIET_TIME = 5.0
+
+# python-ldap's pattern for the values that must be base64 encoded - saved
+# before Entry replaces ldif.safe_string_re for display, so that the LDIF
+# files written by EntryWriter are still correct
+_ldif_safe_string_re = ldif.safe_string_re
+
 
 class Error(Exception):
     pass
@@ -203,6 +236,11 @@ class Entry(object):
         single value or a list of values."""
         return self.data.items()
 
+    def copy(self):
+        """Return a copy of the entry - changing the values of the copy does
+        not change this entry"""
+        return Entry((self.dn, dict([(k, list(v)) for k, v in self.data.items()])))
+
     def getref(self):
         return self.ref
 
@@ -221,90 +259,255 @@ class Entry(object):
 
     def __repr__(self):
         """Convert the Entry to its LDIF representation"""
-        sio = cStringIO.StringIO()
-        # what's all this then?  the unparse method will currently only accept
-        # a list or a dict, not a class derived from them.  self.data is a
-        # cidict, so unparse barfs on it.  I've filed a bug against python-ldap,
-        # but in the meantime, we have to convert to a plain old dict for printing
-        # I also don't want to see wrapping, so set the line width really high (1000)
-        newdata = {}
-        newdata.update(self.data)
-        ldif.LDIFWriter(
-            sio, Entry.base64_attrs, 1000).unparse(self.dn, newdata)
-        return sio.getvalue()
-
-
-class CSN(object):
-    """CSN is Change Sequence Number
-        csn.ts is the timestamp (time_t - seconds)
-        csn.seq is the sequence number (max 65535)
-        csn.rid is the replica ID of the originating master
-        csn.subseq is not currently used"""
-    csnpat = r'(.{8})(.{4})(.{4})(.{4})'
-    csnre = re.compile(csnpat)
-
-    def __init__(self, csnstr):
-        match = CSN.csnre.match(csnstr)
-        self.ts = 0
-        self.seq = 0
-        self.rid = 0
-        self.subseq = 0
-        if match:
-            self.ts = int(match.group(1), 16)
-            self.seq = int(match.group(2), 16)
-            self.rid = int(match.group(3), 16)
-            self.subseq = int(match.group(4), 16)
-        elif csnstr:
-            self.ts = 0
-            self.seq = 0
-            self.rid = 0
-            self.subseq = 0
-            print csnstr, "is not a valid CSN"
-
-    def csndiff(self, oth):
-        return (oth.ts - self.ts, oth.seq - self.seq, oth.rid - self.rid, oth.subseq - self.subseq)
+        # ldif.LDIFWriter.unparse only accepts a real dict, not a cidict, so
+        # EntryWriter is used to avoid copying self.data.  I also don't want
+        # to see wrapping, so the line width is really high (1000)
+        return EntryWriter(None, safe_re=ldif.safe_string_re).format(self.dn, self.data.items())
+
+
+class CompactEntry(object):
+    """A read mostly Entry for bulk work, e.g. keeping every entry of a
+    large LDIF file in memory.
+
+        There is no instance __dict__ and no cidict.  The attribute names
+        are a tuple of the names as read, and that tuple is shared by every
+        entry with the same attributes in the same order (CompactEntry.layouts),
+        along with a tuple of the same names in lower case for lookups - so
+        names are matched case insensitively, but written as read, like Entry.
+        The values are a tuple of tuples, in the same order as the names.
+        The read methods of Entry (getValue, getValues, hasValue, entry.cn,
+        etc.) are supported.  setValue works but rebuilds the tuples, so
+        use Entry if the entry is going to be changed a lot.
+    """
+    __slots__ = ('dn', 'ref', 'names', 'vals')
+    # interned attribute names - key is the name as read, val is a tuple of
+    # the interned name and the interned lower case name
+    attrtab = {}
+    # shared tuples of attribute names - key is the tuple of names as read,
+    # val is a tuple of the same tuple and the tuple of lower case names
+    layouts = {}
 
-    def __cmp__(self, oth):
-        if self is oth:
-            return 0
-        (tsdiff, seqdiff, riddiff, subseqdiff) = self.csndiff(oth)
+    def __init__(self, entrydata):
+        """entrydata is the same as for Entry"""
+        self.ref = None
+        self.dn = ''
+        self.names = ()
+        self.vals = ()
+        if entrydata:
+            if isinstance(entrydata, tuple):
+                if entrydata[0] is None:
+                    self.ref = entrydata[1]  # continuation reference
+                else:
+                    self.dn = entrydata[0]
+                    attrs = entrydata[1]
+                    self.setnames([CompactEntry.internname(name)[0] for name in attrs.keys()])
+                    self.vals = tuple([tuple(attrs[name]) for name in attrs.keys()])
+            elif isinstance(entrydata, basestring):
+                self.dn = entrydata
 
-        diff = tsdiff or seqdiff or riddiff or subseqdiff
-        ret = 0
-        if diff > 0:
-            ret = 1
-        elif diff < 0:
-            ret = -1
-        return ret
+    @staticmethod
+    def internname(name):
+        """return (name, lower case name), both interned"""
+        names = CompactEntry.attrtab.get(name)
+        if names is None:
+            names = (intern(name), intern(name.lower()))
+            CompactEntry.attrtab[name] = names
+        return names
+
+    def setnames(self, names):
+        names = tuple(names)
+        layout = CompactEntry.layouts.get(names)
+        if layout is None:
+            lnames = tuple([CompactEntry.internname(name)[1] for name in names])
+            layout = CompactEntry.layouts[names] = (names, lnames)
+        self.names = layout[0]
+
+    def index(self, name):
+        layout = CompactEntry.layouts.get(self.names)
+        if layout is None:  # not made by setnames e.g. unpickled
+            self.setnames(self.names)
+            layout = CompactEntry.layouts[self.names]
+        try:
+            return layout[1].index(CompactEntry.internname(name)[1])
+        except ValueError:
+            return -1
 
-    def __eq__(self, oth):
-        return cmp(self, oth) == 0
+    def __nonzero__(self):
+        return len(self.names) > 0
 
-    def diff2str(self, oth):
-        retstr = ''
-        diff = oth.ts - self.ts
-        if diff > 0:
-            td = datetime.timedelta(seconds=diff)
-            retstr = "is behind by %s" % td
-        elif diff < 0:
-            td = datetime.timedelta(seconds=-diff)
-            retstr = "is ahead by %s" % td
+    def hasAttr(self, name):
+        return self.index(name) >= 0
+
+    def __getattr__(self, name):
+        """entry.cn is the same as entry.getValue('cn')"""
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.getValue(name)
+
+    def getValues(self, name):
+        ii = self.index(name)
+        if ii < 0:
+            return []
+        return list(self.vals[ii])
+
+    def getValue(self, name):
+        ii = self.index(name)
+        if ii < 0 or not self.vals[ii]:
+            return None
+        return self.vals[ii][0]
+
+    def hasValue(self, name, val=None):
+        ii = self.index(name)
+        if ii < 0:
+            return False
+        if not val:
+            return True
+        if isinstance(val, list) or isinstance(val, tuple):
+            return tuple(val) == self.vals[ii]
+        return val in self.vals[ii]
+
+    def hasValueCase(self, name, val):
+        ii = self.index(name)
+        if ii < 0:
+            return False
+        return val.lower() in [x.lower() for x in self.vals[ii]]
+
+    def setValue(self, name, *value):
+        if isinstance(value[0], list) or isinstance(value[0], tuple):
+            value = value[0]
+        ii = self.index(name)
+        names = list(self.names)
+        vals = list(self.vals)
+        if ii < 0:
+            names.append(CompactEntry.internname(name)[0])
+            vals.append(tuple(value))
         else:
-            diff = oth.seq - self.seq
-            if diff:
-                retstr = "seq differs by %d" % diff
-            elif self.rid != oth.rid:
-                retstr = "rid %d not equal to rid %d" % (self.rid, oth.rid)
-            else:
-                retstr = "equal"
-        return retstr
+            vals[ii] = tuple(value)
+        self.setnames(names)
+        self.vals = tuple(vals)
 
-    def __repr__(self):
-        return time.strftime("%x %X", time.localtime(self.ts)) + " seq: " + str(self.seq) + " rid: " + str(self.rid)
+    setValues = setValue
+
+    def getAttrs(self):
+        return list(self.names)
+
+    def iterAttrs(self, attrsOnly=False):
+        if attrsOnly:
+            return iter(self.names)
+        else:
+            return iter(self.toTupleList())
+
+    def toTupleList(self):
+        return zip(self.names, [list(vv) for vv in self.vals])
+
+    def getref(self):
+        return self.ref
+
+    def getdata(self):
+        """a cidict copy of the attributes - for code that uses entry.data"""
+        return cidict(dict(self.toTupleList()))
+    data = property(getdata)
 
     def __str__(self):
         return self.__repr__()
 
+    def __repr__(self):
+        """Convert the entry to its LDIF representation"""
+        return EntryWriter(None, safe_re=ldif.safe_string_re).format(self.dn, self.toTupleList())
+
+
+class EntryWriter(object):
+    """Write many entries to one LDIF file.
+
+        One EntryWriter is used for the whole file, each entry is formatted
+        into one string and written with one call to a buffered file, and
+        the Entry data is used as is (no copy to a plain dict as
+        ldif.LDIFWriter needs).  The attributes are sorted, values in
+        base64_attrs (default Entry.base64_attrs) or matching safe_re are
+        base64 encoded, and lines are folded at cols.  safe_re defaults to
+        python-ldap's own pattern (binary values, leading spaces, newlines,
+        etc.) - Entry.__repr__ passes ldif.safe_string_re, which Entry
+        replaces so that values are displayed in raw form.
+
+        writer = EntryWriter('/tmp/out.ldif')
+        writer.writeall(conn.search_iter(suffix, ldap.SCOPE_SUBTREE))
+        writer.close()
+
+        unparse(dn, entrydict) is also provided, so an EntryWriter can be
+        used where an ldif.LDIFWriter is expected for entry records.
+    """
+
+    def __init__(self, output, base64_attrs=None, cols=1000, bufsize=1024 * 1024,
+                 safe_re=None):
+        self.openedfile = False
+        if isinstance(output, basestring):
+            output = open(output, 'w', bufsize)
+            self.openedfile = True
+        self.output = output
+        if base64_attrs is None:
+            base64_attrs = Entry.base64_attrs
+        self.base64_attrs = dict([(attr.lower(), 1) for attr in base64_attrs])
+        self.cols = cols
+        if safe_re is None:
+            safe_re = _ldif_safe_string_re
+        self.safe_re = safe_re
+        self.records_written = 0
+
+    def fold(self, line, lines):
+        cols = self.cols
+        if len(line) <= cols:
+            lines.append(line)
+            return
+        lines.append(line[:cols])
+        pos = cols
+        while pos < len(line):
+            lines.append(' ' + line[pos:pos + cols - 1])
+            pos += cols - 1
+
+    def format(self, dn, attrs):
+        """Return the LDIF for dn and attrs - attrs is a dict, cidict, or
+        list of (attr, values) tuples"""
+        if hasattr(attrs, 'items'):
+            attrs = attrs.items()
+        safe = self.safe_re  # really the "needs base64" pattern
+        lines = []
+        if safe.search(dn) is not None:
+            self.fold('dn:: ' + base64.b64encode(dn), lines)
+        else:
+            self.fold('dn: ' + dn, lines)
+        for attr, vals in sorted(attrs):
+            forceb64 = attr.lower() in self.base64_attrs
+            for val in vals:
+                if forceb64 or safe.search(val) is not None:
+                    self.fold(attr + ':: ' + base64.b64encode(val), lines)
+                else:
+                    self.fold(attr + ': ' + val, lines)
+        lines.append('')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def unparse(self, dn, record):
+        self.output.write(self.format(dn, record))
+        self.records_written += 1
+
+    def write(self, ent):
+        self.unparse(ent.dn, ent.toTupleList())
+
+    def writeall(self, entries):
+        """write an iterable of Entry or CompactEntry - return the count"""
+        nents = 0
+        for ent in entries:
+            self.unparse(ent.dn, ent.toTupleList())
+            nents += 1
+        return nents
+
+    def close(self):
+        """close the file if we opened it, otherwise just flush it"""
+        if self.openedfile:
+            self.output.close()
+        else:
+            self.output.flush()
+
 
 class RUV(object):
     """RUV is Replica Update Vector
@@ -402,6 +605,31 @@ class RUV(object):
             retstr = "\tup-to-date - RUVs are equal"
         return (diff, retstr)
 
+    def lag(self, oth):
+        """Return a dict of replica ID -> how many seconds the max csn of
+        that replica in oth is behind the one in self (negative if ahead),
+        or None if oth has no max csn for it"""
+        ret = {}
+        for rid, rec in self.rid.items():
+            if not rec['max'].ts:
+                continue  # no changes from this replica yet
+            othrec = oth.rid.get(rid)
+            if not othrec or not othrec['max'].ts:
+                ret[rid] = None
+            else:
+                ret[rid] = rec['max'].ts - othrec['max'].ts
+        return ret
+
+    def maxlag(self, oth):
+        """the largest lag (see lag) over all replica IDs - 0 if oth is not
+        behind self, None if oth has not seen one of the replicas at all"""
+        ret = 0
+        for val in self.lag(oth).values():
+            if val is None:
+                return None
+            ret = max(ret, val)
+        return ret
+
 
 def wrapper(f, name):
     """This is the method that wraps all of the methods of the superclass.  This seems
@@ -443,7 +671,7 @@ def wrapper(f, name):
             # We need to convert the Entry into the format used by
             # python-ldap
             ent = args[0]
-            if isinstance(ent, Entry):
+            if isinstance(ent, Entry) or isinstance(ent, CompactEntry):
                 return f(ent.dn, ent.toTupleList(), *args[2:])
             else:
                 return f(*args, **kargs)
@@ -452,24 +680,306 @@ def wrapper(f, name):
     return inner
 
 
+class LDIFIndex(object):
+    """On disk index of the records in an LDIF file, for random access to
+    files much too big to parse into memory.
+
+        The key is the normalized DN, the value is the byte offset and length
+        of the record.  The index is built with one streaming pass over the
+        file and stored in a dbm file (indexfile, default ldiffile.dnidx) along
+        with the mtime and size of the LDIF file - if either changes, the index
+        is rebuilt the next time it is opened.  get(dn) seeks to the record
+        and parses only that record, so the file cannot be compressed.
+    """
+    MTIMEKEY = '\0mtime'
+    SIZEKEY = '\0size'
+
+    def __init__(self, ldiffile, indexfile=None, verbose=False):
+        kind = compression(ldiffile)
+        if kind:
+            raise InvalidArgumentError("%s is %s compressed - an LDIF index needs "
+                                       "an uncompressed file" % (ldiffile, kind))
+        self.ldiffile = ldiffile
+        self.indexfile = indexfile or (ldiffile + '.dnidx')
+        self.verbose = verbose
+        st = os.stat(ldiffile)
+        self.mtime = repr(st.st_mtime)
+        self.size = str(st.st_size)
+        self.db = None
+        try:
+            self.db = anydbm.open(self.indexfile, 'r')
+            if self.db.get(LDIFIndex.MTIMEKEY) != self.mtime or \
+                    self.db.get(LDIFIndex.SIZEKEY) != self.size:
+                self.db.close()
+                self.db = None
+        except anydbm.error:
+            self.db = None
+        if self.db is None:
+            self.build()
+            self.db = anydbm.open(self.indexfile, 'r')
+        self.ldiffp = open(ldiffile, 'rb')
+
+    def build(self):
+        """read the LDIF file once, recording where each record starts
+        and how long it is"""
+        if self.verbose:
+            print "Building DN index %s for %s" % (self.indexfile, self.ldiffile)
+        db = anydbm.open(self.indexfile, 'n')
+        fp = open(self.ldiffile, 'rb')
+        offset = 0
+        start = -1  # offset of the current record, -1 if between records
+        dnlines = None  # dn: line plus continuation lines
+        indn = False
+        nrecs = 0
+        for line in fp:
+            if not line.strip():
+                if start >= 0 and dnlines:
+                    LDIFIndex.addrec(db, dnlines, start, offset - start)
+                    nrecs += 1
+                start = -1
+                dnlines = None
+                indn = False
+            elif start < 0:
+                if not line.startswith('#') and not line.startswith('version:'):
+                    start = offset
+                    if line[:3].lower() == 'dn:':
+                        dnlines = [line.rstrip('\r\n')]
+                        indn = True
+            elif indn:
+                if line.startswith(' '):
+                    dnlines.append(line[1:].rstrip('\r\n'))
+                else:
+                    indn = False
+            offset += len(line)
+        if start >= 0 and dnlines:
+            LDIFIndex.addrec(db, dnlines, start, offset - start)
+            nrecs += 1
+        fp.close()
+        db[LDIFIndex.MTIMEKEY] = self.mtime
+        db[LDIFIndex.SIZEKEY] = self.size
+        db.close()
+        if self.verbose:
+            print "Indexed %d records" % nrecs
+
+    @staticmethod
+    def addrec(db, dnlines, start, length):
+        dn = ''.join(dnlines)[3:]
+        if dn.startswith(':'):  # dn:: base64 value
+            dn = base64.decodestring(dn[1:].strip())
+        db[normalizeDN(dn.strip())] = "%d %d" % (start, length)
+
+    def has_key(self, dn):
+        return self.db.has_key(normalizeDN(dn))
+
+    def get(self, dn, entryclass=Entry):
+        val = self.db.get(normalizeDN(dn))
+        if not val:
+            return entryclass(None)
+        offset, length = [int(xx) for xx in val.split()]
+        self.ldiffp.seek(offset)
+        rec = ldif.LDIFRecordList(
+            cStringIO.StringIO(self.ldiffp.read(length)), max_entries=1)
+        rec.parse()
+        if not rec.all_records:
+            return entryclass(None)
+        return entryclass(rec.all_records[0])
+
+    def close(self):
+        self.db.close()
+        self.ldiffp.close()
+
+
+# size of the byte ranges handed to each worker by parallelParseLDIF
+LDIF_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def ldifChunks(ldiffile, chunksize=LDIF_CHUNK_SIZE):
+    """Split ldiffile into a list of (start, end) byte ranges of about
+    chunksize bytes.  Each range ends just after a blank line, so each one
+    holds only whole records and can be parsed on its own.  The file cannot
+    be compressed."""
+    kind = compression(ldiffile)
+    if kind:
+        raise InvalidArgumentError("%s is %s compressed - it cannot be split "
+                                   "into chunks" % (ldiffile, kind))
+    size = os.path.getsize(ldiffile)
+    fp = open(ldiffile, 'rb')
+    chunks = []
+    start = 0
+    while start < size:
+        end = start + chunksize
+        if end >= size:
+            end = size
+        else:
+            fp.seek(end)
+            fp.readline()  # finish the partial line
+            while True:
+                line = fp.readline()
+                if not line or line == '\n' or line == '\r\n':
+                    break
+            end = fp.tell()
+        chunks.append((start, end))
+        start = end
+    fp.close()
+    return chunks
+
+
+def parseLDIFChunk(args):
+    """Parse one byte range of an LDIF file - this runs in the worker
+    processes of parallelParseLDIF, so it must be a module level function.
+    If func is given, it is called as func(dn, entry) for each record and
+    its result is returned instead of the record (None results are dropped)"""
+    ldiffile, start, end, ignored_attr_types, func = args
+    fp = open(ldiffile, 'rb')
+    fp.seek(start)
+    data = fp.read(end - start)
+    fp.close()
+    return parseLDIFText(data, ignored_attr_types, func)
+
+
+def ldifTextChunks(fp, chunksize=LDIF_CHUNK_SIZE):
+    """yield the text read from fp in pieces of about chunksize bytes that
+    end after a blank line - like ldifChunks, for files that cannot seek"""
+    lines = []
+    size = 0
+    for line in fp:
+        lines.append(line)
+        size += len(line)
+        if size >= chunksize and (line == '\n' or line == '\r\n'):
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
+
+
+def parseLDIFText(data, ignored_attr_types=None, func=None):
+    """parse the records in the string data - see parseLDIFChunk"""
+    recs = ldif.LDIFRecordList(cStringIO.StringIO(data), ignored_attr_types)
+    recs.parse()
+    if func is None:
+        return recs.all_records
+    ret = []
+    for dn, entry in recs.all_records:
+        res = func(dn, entry)
+        if res is not None:
+            ret.append(res)
+    return ret
+
+
+def parallelParseLDIF(ldiffile, ordered=True, processes=None,
+                      chunksize=LDIF_CHUNK_SIZE, ignored_attr_types=None, func=None):
+    """Parse ldiffile with a pool of processes and yield (dn, entry) tuples.
+
+        The file is split by ldifChunks and each chunk is parsed by a worker.
+        If ordered is True, the records are yielded in file order, otherwise
+        each chunk is yielded as soon as it is done.  At most two chunks per
+        process are in flight, so memory use does not depend on the file size.
+        processes defaults to the number of CPUs.  func - see parseLDIFChunk -
+        lets the per record work happen in the workers too.  Without the
+        multiprocessing module, or with processes=1, the chunks are parsed
+        in this process.  A compressed file cannot be split, so it is
+        decompressed and parsed in this process, a chunk at a time.
+    """
+    if compression(ldiffile):
+        fp = openInput(ldiffile)
+        try:
+            for data in ldifTextChunks(fp, chunksize):
+                for rec in parseLDIFText(data, ignored_attr_types, func):
+                    yield rec
+        except:
+            fp.close()
+            raise
+        fp.close()
+        return
+    work = [(ldiffile, start, end, ignored_attr_types, func)
+            for (start, end) in ldifChunks(ldiffile, chunksize)]
+    if not HASMP or processes == 1:
+        for args in work:
+            for rec in parseLDIFChunk(args):
+                yield rec
+        return
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    pending = deque()
+    todo = iter(work)
+    # no yield inside try/finally - python 2.4
+    try:
+        while True:
+            while len(pending) < 2 * processes:
+                try:
+                    args = todo.next()
+                except StopIteration:
+                    break
+                pending.append(pool.apply_async(parseLDIFChunk, (args,)))
+            if not pending:
+                break
+            res = pending[0]  # the oldest one if nothing else is ready
+            if not ordered:
+                for rr in pending:
+                    if rr.ready():
+                        res = rr
+                        break
+            pending.remove(res)
+            for rec in res.get():
+                yield rec
+    except:
+        # an error, or the caller stopped iterating (GeneratorExit) - let
+        # the chunks in flight finish first, terminate can deadlock on a
+        # worker that is writing a large result
+        for res in pending:
+            res.wait()
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+
 class LDIFConn(ldif.LDIFParser):
     def __init__(
         self,
         input_file,
-        ignored_attr_types=None, max_entries=0, process_url_schemes=None
+        ignored_attr_types=None, max_entries=0, process_url_schemes=None,
+        entryclass=Entry, index=None, processes=0
     ):
         """
         See LDIFParser.__init__()
 
         Additional Parameters:
-        all_records
-        List instance for storing parsed records
+        entryclass
+        class used to hold each record - use CompactEntry for big files
+        index
+        if True, do not parse the file - use an LDIFIndex to look up records
+        in get() - if a string, it is the name of the index file to use
+        dndict and dnlist are left empty in this case
+        processes
+        if not 0, parse the file with parallelParseLDIF using this many
+        processes - input_file must be a file name
         """
+        self.entryclass = entryclass
         self.dndict = {}  # maps dn to Entry
         self.dnlist = []  # contains entries in order read
+        self.index = None
+        if index:
+            indexfile = None
+            if isinstance(index, basestring):
+                indexfile = index
+            self.index = LDIFIndex(input_file, indexfile)
+            return
+        if processes:
+            self.records_read = 0
+            for dn, entry in parallelParseLDIF(input_file, True, processes,
+                                               ignored_attr_types=ignored_attr_types):
+                if max_entries and self.records_read >= max_entries:
+                    break
+                self.handle(dn, entry)
+                self.records_read += 1
+            return
         myfile = input_file
         if isinstance(input_file, basestring):
-            myfile = open(input_file, "r")
+            myfile = openInput(input_file)
         ldif.LDIFParser.__init__(self, myfile, ignored_attr_types,
                                  max_entries, process_url_schemes)
         self.parse()
@@ -482,21 +992,782 @@ class LDIFConn(ldif.LDIFParser):
         """
         if not dn:
             dn = ''
-        newentry = Entry((dn, entry))
+        newentry = self.entryclass((dn, entry))
         self.dndict[normalizeDN(dn)] = newentry
         self.dnlist.append(newentry)
 
     def get(self, dn):
+        if self.index:
+            return self.index.get(dn, self.entryclass)
         ndn = normalizeDN(dn)
-        return self.dndict.get(ndn, Entry(None))
+        return self.dndict.get(ndn, self.entryclass(None))
+
+
+class LDIFCallback(ldif.LDIFParser):
+    """Call func(dn, entry) for each record in input_file - nothing is kept,
+    so memory use does not depend on the size of the file.  If processes is
+    not 0 and input_file is a file name, the file is parsed by
+    parallelParseLDIF with that many processes (None - one per CPU), and
+    func is still called in file order in this process."""
+
+    def __init__(self, input_file, func,
+                 ignored_attr_types=None, max_entries=0, process_url_schemes=None,
+                 processes=0):
+        if processes != 0 and isinstance(input_file, basestring):
+            self.records_read = 0
+            for dn, entry in parallelParseLDIF(input_file, True, processes,
+                                               ignored_attr_types=ignored_attr_types):
+                func(dn, entry)
+                self.records_read += 1
+            return
+        myfile = input_file
+        if isinstance(input_file, basestring):
+            myfile = openInput(input_file)
+        self.func = func
+        ldif.LDIFParser.__init__(self, myfile, ignored_attr_types,
+                                 max_entries, process_url_schemes)
+        self.parse()
+        if isinstance(input_file, basestring):
+            myfile.close()
+
+    def handle(self, dn, entry):
+        self.func(dn, entry)
+
+
+class LDIFLookup(object):
+    """A disk backed map built with one pass over an LDIF file, e.g. to
+    look up the DN of an entry by its cn without keeping the entries.
+
+        keyfunc(dn, entry) returns the key, a list of keys, or None to skip
+        the record.  valfunc(dn, entry) returns the value - the default is
+        the dn.  If a key is used by more than one record, the last one wins.
+        The dbm file is created in a temporary directory unless dbfile is
+        given, and is removed by close().  processes - see LDIFCallback.
+    """
+
+    def __init__(self, ldiffile, keyfunc, valfunc=None, dbfile=None, processes=0):
+        self.tmpdir = None
+        if not dbfile:
+            self.tmpdir = tempfile.mkdtemp()
+            dbfile = os.path.join(self.tmpdir, 'lookup')
+        self.keyfunc = keyfunc
+        self.valfunc = valfunc
+        self.db = anydbm.open(dbfile, 'n')
+        LDIFCallback(ldiffile, self.add, processes=processes)
+
+    def add(self, dn, entry):
+        keys = self.keyfunc(dn, entry)
+        if keys is None:
+            return
+        if not isinstance(keys, list):
+            keys = [keys]
+        val = dn
+        if self.valfunc:
+            val = self.valfunc(dn, entry)
+        for key in keys:
+            self.db[key] = val
+
+    def get(self, key, default=None):
+        return self.db.get(key, default)
+
+    def close(self):
+        self.db.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, True)
+
+
+class LDIFPipeline(object):
+    """Stream the records of an LDIF file through a list of stages, in
+    constant memory.
+
+        pipe = LDIFPipeline('export.ldif')
+        cn2dn = pipe.lookup('cn2dn', lambda dn, ent: ent.get('cn', [None])[0])
+        pipe.map(fixmanager)        # (dn, entry) -> (dn, entry), a list, or None
+        pipe.filter(isperson)       # (dn, entry) -> True to keep the record
+        pipe.partition(bysuffix, {'o=a': 'a.ldif', 'o=b': 'b.ldif'})
+        pipe.write(sys.stdout)      # everything that got this far
+        pipe.run()
+
+        Stages run in the order they were added.  map may return a list of
+        records to emit several, or None to drop the record.  write and
+        partition do not consume the record, so several of them can be used
+        to fan out.  partition sends each record to the output for the key
+        returned by keyfunc(dn, entry) - records with no output are not
+        written there.  Outputs may be files or file names.  lookup() makes
+        the pipeline two pass: the lookup is built from the whole file before
+        run() starts, and is available to the stages as pipe.lookups[name].
+        If processes is not 0, the file is parsed with a pool of that many
+        processes (see LDIFCallback) - the stages still run in this process,
+        on the records in file order.
+    """
+
+    def __init__(self, input_file, processes=0):
+        self.input_file = input_file
+        self.processes = processes
+        self.stages = []
+        self.lookups = {}
+        self.writers = []
+        self.nread = 0
+        self.nwritten = 0
+
+    def lookup(self, name, keyfunc, valfunc=None, dbfile=None):
+        if not isinstance(self.input_file, basestring):
+            raise InvalidArgumentError("two pass mode needs an LDIF file name")
+        self.lookups[name] = LDIFLookup(self.input_file, keyfunc, valfunc, dbfile,
+                                        self.processes)
+        return self.lookups[name]
+
+    def map(self, func):
+        self.stages.append(('map', func))
+        return self
+
+    def filter(self, func):
+        self.stages.append(('filter', func))
+        return self
+
+    def write(self, output, cols=1000):
+        self.stages.append(('write', self.writer(output, cols)))
+        return self
+
+    def partition(self, keyfunc, outputs, cols=1000):
+        writers = {}
+        for key, output in outputs.items():
+            writers[key] = self.writer(output, cols)
+        self.stages.append(('partition', (keyfunc, writers)))
+        return self
+
+    def writer(self, output, cols):
+        writer = EntryWriter(output, Entry.base64_attrs, cols)
+        self.writers.append(writer)
+        return writer
+
+    def process(self, dn, entry):
+        self.nread += 1
+        records = [(dn, entry)]
+        for kind, arg in self.stages:
+            if kind == 'map':
+                newrecs = []
+                for rec in records:
+                    res = arg(*rec)
+                    if isinstance(res, list):
+                        newrecs.extend(res)
+                    elif res is not None:
+                        newrecs.append(res)
+                records = newrecs
+            elif kind == 'filter':
+                records = [rec for rec in records if arg(*rec)]
+            elif kind == 'write':
+                for rec in records:
+                    arg.unparse(*rec)
+                    self.nwritten += 1
+            elif kind == 'partition':
+                keyfunc, writers = arg
+                for rec in records:
+                    writer = writers.get(keyfunc(*rec))
+                    if writer:
+                        writer.unparse(*rec)
+                        self.nwritten += 1
+            if not records:
+                break
+
+    def run(self):
+        """run the records through the stages, then close the files opened
+        for the outputs and the lookups - returns (records read, records written)"""
+        try:
+            LDIFCallback(self.input_file, self.process, processes=self.processes)
+        finally:
+            for writer in self.writers:
+                writer.close()
+            for lookup in self.lookups.values():
+                lookup.close()
+        return self.nread, self.nwritten
+
+
+class LDIFAdder(ldif.LDIFParser):
+    """Add the entries in an LDIF file to conn without waiting for each
+    result before sending the next entry.  Up to window add_ext requests
+    are kept outstanding; results are collected in the order the requests
+    were sent so that each error can be reported with its dn.  If cont is
+    False the first error is raised, otherwise it is printed and the load
+    goes on.  Exceptions listed in ignore are silently skipped.  If verbose
+    is True, the number of entries added and the rate are printed.  The server
+    may process the requests on a connection in any order, so an entry is
+    not sent until the add of its parent, if still outstanding, is done.
+
+    Subclasses may override handle() to modify the entry before calling
+    self.add(entry).  conn may be a DSAdmin or a plain ldap connection."""
+
+    def __init__(self, input_file, conn, cont=False, window=100, ignore=(), verbose=False,
+                 ignored_attr_types=None, max_entries=0, process_url_schemes=None):
+        myfile = input_file
+        if isinstance(input_file, basestring):
+            myfile = openInput(input_file)
+        self.conn = conn
+        self.cont = cont
+        self.window = max(1, window)
+        self.ignore = tuple(ignore)
+        self.pending = deque()  # (msgid, dn) in the order sent
+        self.outstanding = {}  # normalized dn -> number of adds pending
+        self.nadded = 0
+        self.nerrors = 0
+        ldif.LDIFParser.__init__(self, myfile, ignored_attr_types,
+                                 max_entries, process_url_schemes)
+        start = time.time()
+        self.parse()
+        self.drain()
+        elapsed = time.time() - start
+        if isinstance(input_file, basestring):
+            myfile.close()
+        if verbose:
+            rate = 0.0
+            if elapsed > 0:
+                rate = (self.nadded + self.nerrors) / elapsed
+            print "Added %d entries (%d errors) in %.2f seconds - %.1f entries/sec" % (
+                self.nadded, self.nerrors, elapsed, rate)
+
+    def handle(self, dn, entry):
+        if not dn:
+            dn = ''
+        self.add(Entry((dn, entry)))
+
+    def add(self, ent):
+        """send the add request - wait for the oldest one if the window is
+        full, and for the add of the parent entry if it is still pending"""
+        rdns = ldap.explode_dn(ent.dn.lower())
+        parent = ','.join(rdns[1:])
+        while parent in self.outstanding:
+            self.collect(True)
+        msgid = self.conn.add_ext(ent.dn, ent.toTupleList())
+        ndn = ','.join(rdns)
+        self.pending.append((msgid, ent.dn, ndn))
+        self.outstanding[ndn] = self.outstanding.get(ndn, 0) + 1
+        self.collect(False)
+        while len(self.pending) >= self.window:
+            self.collect(True)
+
+    def collect(self, block):
+        """read the results of the completed requests at the head of the queue
+        if block is True, wait for at least the oldest one"""
+        timeout = -1
+        if not block:
+            timeout = 0
+        while self.pending:
+            msgid, dn, ndn = self.pending[0]
+            try:
+                rtype, rdata = self.conn.result(msgid, 1, timeout)
+                if rtype is None:  # not done yet
+                    return
+                self.nadded += 1
+            except self.ignore:
+                pass
+            except ldap.LDAPError, e:
+                self.nerrors += 1
+                if not self.cont:
+                    self.done()
+                    raise e
+                print "Error: could not add entry %s: error %s" % (dn, str(e))
+            self.done()
+            timeout = 0
+
+    def done(self):
+        """forget the request at the head of the queue"""
+        msgid, dn, ndn = self.pending.popleft()
+        self.outstanding[ndn] -= 1
+        if not self.outstanding[ndn]:
+            del self.outstanding[ndn]
+
+    def drain(self):
+        while self.pending:
+            self.collect(True)
+
+
+TASK_ATTRS = ['nsTaskLog', 'nsTaskStatus', 'nsTaskExitCode',
+              'nsTaskCurrentItem', 'nsTaskTotalItems']
+
+
+class Task(object):
+    """A handle for a task entry under cn=tasks,cn=config on the server of
+    conn.  start() adds the entry, poll() reads the task status once, and
+    wait() polls until the task has finished and returns its exit code.
+    Use waitTasks to wait for many tasks, on any number of servers, at
+    once.  Progress is taken from nsTaskCurrentItem and nsTaskTotalItems:
+    rate() is items per second - since the first progress seen while the
+    task is running, over the whole run once it has finished - and eta()
+    is the estimated number of seconds left (None if not known)."""
+
+    def __init__(self, conn, entry):
+        self.conn = conn
+        self.entry = entry
+        self.dn = entry.dn
+        self.name = entry.dn  # e.g. the backend name for bulk imports
+        self.exitcode = None
+        self.status = None
+        self.current = 0
+        self.total = 0
+        self.started = None
+        self.finished = None
+        self.first = None  # (time, current) when progress was first seen
+        self.interval = 0  # seconds to wait before the next poll
+        self.nextpoll = 0
+
+    def __str__(self):
+        msg = "%s %s: %d/%d items" % (self.conn, self.dn, self.current, self.total)
+        rate = self.rate()
+        if rate:
+            msg += " %.1f items/sec" % rate
+        eta = self.eta()
+        if self.done():
+            msg += " exit code %d in %.1f seconds" % (self.exitcode, self.elapsed())
+        elif eta is not None:
+            msg += " eta %.0f seconds" % eta
+        return msg
+
+    def start(self, verbose=False):
+        self.started = time.time()
+        return self.conn.startTask(self.entry, verbose)
+
+    def done(self):
+        return self.exitcode is not None
+
+    def elapsed(self):
+        end = self.finished or time.time()
+        return end - (self.started or end)
+
+    def rate(self):
+        if self.finished:
+            if self.elapsed() <= 0:
+                return 0.0
+            return self.current / self.elapsed()
+        if not self.first:
+            return 0.0
+        secs = time.time() - self.first[0]
+        if secs <= 0:
+            return 0.0
+        return (self.current - self.first[1]) / secs
+
+    def eta(self):
+        if self.done():
+            return 0
+        rate = self.rate()
+        if not rate or self.total <= 0:
+            return None
+        return max(self.total - self.current, 0) / rate
+
+    def update(self, entry):
+        """update the status from the task entry - return True if the task
+        has made progress or finished"""
+        prev = self.current
+        self.status = entry.nsTaskStatus
+        self.current = int(entry.nsTaskCurrentItem or 0)
+        self.total = int(entry.nsTaskTotalItems or 0)
+        if self.current and not self.first:
+            self.first = (time.time(), self.current)
+        if entry.nsTaskExitCode:
+            self.exitcode = int(entry.nsTaskExitCode)
+            self.finished = time.time()
+            return True
+        return self.current != prev
+
+    def poll(self, verbose=False):
+        """read the task entry once - return True if the task is done"""
+        return waitTasks([self], 0, verbose) == 0
+
+    def wait(self, timeout=None, verbose=False):
+        """wait for the task to finish and return its exit code, or None
+        if it has not finished after timeout seconds"""
+        waitTasks([self], timeout, verbose)
+        return self.exitcode
+
+
+def waitTasks(tasks, timeout=None, verbose=False, mininterval=0.1,
+              maxinterval=5.0, first=False):
+    """Wait until all of tasks (Task objects, possibly on different
+    servers) have finished, or timeout seconds have passed.  Each round
+    sends a status search for every task that is due to be polled, then
+    reads all of the results, so the servers are polled concurrently.
+    The poll interval of a task starts at mininterval and doubles, up to
+    maxinterval, each time the task has made no progress - if it has,
+    the interval is reset, or set to a quarter of its eta if that is
+    longer.  A timeout of 0 polls every task once.  If first is True,
+    return as soon as any of the tasks has finished.  Return the number of
+    tasks still running.  If a search fails with anything but
+    NO_SUCH_OBJECT, the searches not yet read are abandoned and the error
+    is raised."""
+    start = time.time()
+    running = [task for task in tasks if not task.done()]
+    while running:
+        now = time.time()
+        pending = deque()
+        try:
+            for task in running:
+                if task.nextpoll <= now or timeout == 0:
+                    msgid = task.conn.search_ext(task.dn, ldap.SCOPE_BASE,
+                                                 "(objectclass=*)", TASK_ATTRS)
+                    pending.append((task, msgid))
+            while pending:
+                task, msgid = pending.popleft()
+                try:
+                    rtype, ents = task.conn.result(msgid)
+                except ldap.NO_SUCH_OBJECT:
+                    ents = []
+                if not ents:
+                    # removed already (nsTaskTTL), or hidden from us - we
+                    # missed the exit code
+                    task.exitcode = -1
+                    task.finished = time.time()
+                    continue
+                if task.update(ents[0]):
+                    task.interval = mininterval
+                    eta = task.eta()
+                    if eta:
+                        task.interval = max(mininterval, min(maxinterval, eta / 4))
+                else:
+                    task.interval = min(maxinterval, max(mininterval, task.interval * 2))
+                task.nextpoll = time.time() + task.interval
+                if verbose:
+                    print task
+        except:
+            # do not leave the other results unread on the connections
+            exc = sys.exc_info()
+            for task, msgid in pending:
+                try:
+                    task.conn.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+            raise exc[0], exc[1], exc[2]
+        nrunning = len(running)
+        running = [task for task in running if not task.done()]
+        if not running or timeout == 0 or (first and len(running) < nrunning):
+            break
+        now = time.time()
+        wakeup = min([task.nextpoll for task in running])
+        if timeout is not None:
+            if now - start >= timeout:
+                break
+            wakeup = min(wakeup, start + timeout)
+        if wakeup > now:
+            time.sleep(wakeup - now)
+    return len(running)
+
+
+def runTasks(launch, args, maxtasks=4, verbose=False):
+    """Call launch(*arg) for each arg in args - launch starts a task and
+    returns its Task - keeping at most maxtasks tasks running at once.
+    Wait for all of them to finish and return the tasks in the order of
+    args."""
+    tasks = []
+    running = []
+    pending = deque(args)
+    while pending or running:
+        while pending and len(running) < maxtasks:
+            task = launch(*pending.popleft())
+            tasks.append(task)
+            running.append(task)
+        waitTasks(running, None, verbose, first=True)
+        running = [task for task in running if not task.done()]
+    return tasks
+
+
+def printTaskStats(tasks, wall=None):
+    """print the exit code, items, items/sec and seconds of each task,
+    and the totals - wall is the elapsed time of the whole run"""
+    print "%-30s %5s %10s %10s %10s" % ('name', 'rc', 'items', 'items/sec', 'seconds')
+    for task in tasks:
+        print "%-30s %5s %10d %10.1f %10.2f" % (
+            task.name, task.exitcode, task.current, task.rate(), task.elapsed())
+    total = sum([task.current for task in tasks])
+    if wall is None:
+        wall = max([task.elapsed() for task in tasks] or [0])
+    rate = 0.0
+    if wall > 0:
+        rate = total / wall
+    print "%-30s %5s %10d %10.1f %10.2f" % ('total', '', total, rate, wall)
+
+
+class ConfigSnapshot(object):
+    """The backends, mapping tree entries, replicas, agreements and
+    indexes of a server, read with one subtree search of cn=config and
+    indexed for lookups:
+
+        backends - normalized suffix -> list of backend entries
+        benames - lower case backend name -> backend entry
+        mtents - normalized suffix -> mapping tree entry
+        replicas - normalized replica root -> replica entry
+        agmts - list of agreement entries
+        indexes - lower case backend name -> {lower case attr: index entry}
+
+    The entries are shared - DSAdmin hands out copies of them.
+
+    signature is the number of entries and their latest modify/create
+    timestamp - isCurrent() compares it with the server, using a search
+    that returns only the timestamps, to find out whether the snapshot
+    is out of date."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.backends = {}
+        self.benames = {}
+        self.mtents = {}
+        self.replicas = {}
+        self.agmts = []
+        self.indexes = {}
+        ents = conn.search_s(DN_CONFIG, ldap.SCOPE_SUBTREE, CONFIG_SNAPSHOT_FILTER,
+                             ['*', 'modifyTimestamp', 'createTimestamp'])
+        self.signature = ConfigSnapshot.sign(ents)
+        self.checked = time.time()
+        for ent in ents:
+            self.addEntry(ent)
+
+    @staticmethod
+    def sign(ents):
+        latest = ''
+        for ent in ents:
+            latest = max(latest, ent.modifyTimestamp or '', ent.createTimestamp or '')
+        return (len(ents), latest)
+
+    def isCurrent(self):
+        ents = self.conn.search_s(DN_CONFIG, ldap.SCOPE_SUBTREE, CONFIG_SNAPSHOT_FILTER,
+                                  ['modifyTimestamp', 'createTimestamp'])
+        self.checked = time.time()
+        return ConfigSnapshot.sign(ents) == self.signature
+
+    def addEntry(self, ent):
+        if ent.hasValueCase('objectclass', 'nsBackendInstance'):
+            nsuffix = normalizeDN(ent.getValue('nsslapd-suffix') or '')
+            self.backends.setdefault(nsuffix, []).append(ent)
+            self.benames[ent.cn.lower()] = ent
+        elif ent.hasValueCase('objectclass', 'nsMappingTree'):
+            for val in ent.getValues('cn'):
+                self.mtents[normalizeDN(val.strip('"'))] = ent
+        elif ent.hasValueCase('objectclass', 'nsds5Replica'):
+            self.replicas[normalizeDN(ent.nsds5replicaroot or '')] = ent
+        elif ent.hasValueCase('objectclass', 'nsds5ReplicationAgreement'):
+            self.agmts.append(ent)
+        elif ent.hasValueCase('objectclass', 'nsIndex'):
+            # cn=attr,cn=index,cn=bename,... - skip cn=default indexes
+            rdns = ldap.explode_dn(ent.dn.lower())
+            if len(rdns) > 2 and rdns[1] == 'cn=index':
+                bename = rdns[2].split('=', 1)[1]
+                self.indexes.setdefault(bename, {})[ent.cn.lower()] = ent
+
+
+def monval(val):
+    """monitor attribute values are strings - return an int if it is one"""
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return val
+
+
+class DBStats(object):
+    """A snapshot of the database monitor entries of a backend - from
+    DSAdmin.getDBStatsSnapshot.  The values are ints where they are
+    numeric:
+
+        time - when the snapshot was taken
+        entrycache, dncache - the entry and DN cache values of the backend
+            monitor keyed by name without the cache prefix - max, current,
+            count, hits, tries, hitratio (dncache is {} if there is none)
+        hashtables - the entrycache-hashtables value, or None
+        dbcache - the global db cache values from cn=monitor keyed by name
+            without the dbcache prefix - hits, tries, hitratio, pagein,
+            pageout, roevict, rwevict
+        db - the nsslapd-db-* values of cn=database keyed by name without
+            the nsslapd-db- prefix
+        files - the per file values keyed by file name (without the
+            directory), each keyed by name without the dbfile prefix -
+            cachehit, cachemiss, pagein, pageout
+
+    The counters are totals since the server started - use delta(prev) to
+    get the rates and hit ratios between two snapshots.  str() gives the
+    text table that getDBStats returns."""
+
+    CACHEATTRS = {'max%scachesize': 'max', 'current%scachesize': 'current',
+                  'current%scachecount': 'count', '%scachehits': 'hits',
+                  '%scachetries': 'tries', '%scachehitratio': 'hitratio'}
+
+    def __init__(self, ent, monent, dbdbent, when=None):
+        self.time = when or time.time()
+        self.entrycache = DBStats.cachevals(ent, 'entry')
+        self.dncache = DBStats.cachevals(ent, 'dn')
+        self.hashtables = ent.getValue('entrycache-hashtables')
+        self.dbcache = {}
+        for attr, vals in monent.iterAttrs():
+            attr = attr.lower()
+            if attr.startswith('dbcache'):
+                self.dbcache[attr[len('dbcache'):]] = monval(vals[0])
+        self.db = {}
+        for attr, vals in dbdbent.iterAttrs():
+            attr = attr.lower()
+            if attr.startswith('nsslapd-db-'):
+                self.db[attr[len('nsslapd-db-'):]] = monval(vals[0])
+        # the per file attrs are numbered e.g. dbfilename-3 (or named,
+        # on Sun servers) - collect them by number, then key by file name
+        bynum = {}
+        for attr, vals in ent.iterAttrs():
+            match = DBMONATTRRE.match(attr) or DBMONATTRRESUN.match(attr)
+            if match and match.group(1).startswith('dbfile'):
+                name = match.group(1)[len('dbfile'):]
+                bynum.setdefault(match.group(2), {})[name] = monval(vals[0])
+        self.files = {}
+        for rec in bynum.itervalues():
+            if 'name' in rec:
+                self.files[str(rec.pop('name')).split('/')[-1]] = rec
+
+    @staticmethod
+    def cachevals(ent, prefix):
+        vals = {}
+        for attr, name in DBStats.CACHEATTRS.iteritems():
+            val = ent.getValue(attr % prefix)
+            if val is not None:
+                vals[name] = monval(val)
+        return vals
+
+    @staticmethod
+    def ratio(hits, tries):
+        if tries > 0:
+            return 100.0 * hits / tries
+        return 0.0
+
+    def delta(self, prev):
+        """Return a dict of the changes since the snapshot prev:
+
+            interval - seconds between the snapshots
+            entrycache, dncache - hits, tries and the hitratio over the
+                interval
+            dbcache - hits, tries and the hitratio over the interval, and
+                pagein, pageout, roevict and rwevict per second
+            files - per file cachehit, cachemiss and hitratio over the
+                interval, and pagein and pageout per second"""
+        interval = self.time - prev.time
+        if interval <= 0:
+            interval = 1.0  # avoid dividing by zero - rates are totals
+
+        def diff(cur, old, name):
+            try:
+                return cur.get(name, 0) - old.get(name, 0)
+            except TypeError:
+                return 0
+
+        ret = {'interval': interval, 'files': {}}
+        for cache in ('entrycache', 'dncache'):
+            cur, old = getattr(self, cache), getattr(prev, cache)
+            hits, tries = diff(cur, old, 'hits'), diff(cur, old, 'tries')
+            ret[cache] = {'hits': hits, 'tries': tries,
+                          'hitratio': DBStats.ratio(hits, tries)}
+        hits = diff(self.dbcache, prev.dbcache, 'hits')
+        tries = diff(self.dbcache, prev.dbcache, 'tries')
+        dbcache = {'hits': hits, 'tries': tries,
+                   'hitratio': DBStats.ratio(hits, tries)}
+        for name in ('pagein', 'pageout', 'roevict', 'rwevict'):
+            dbcache[name] = diff(self.dbcache, prev.dbcache, name) / interval
+        ret['dbcache'] = dbcache
+        for fname, cur in self.files.iteritems():
+            old = prev.files.get(fname, {})
+            hits = diff(cur, old, 'cachehit')
+            misses = diff(cur, old, 'cachemiss')
+            ret['files'][fname] = {
+                'cachehit': hits, 'cachemiss': misses,
+                'hitratio': DBStats.ratio(hits, hits + misses),
+                'pagein': diff(cur, old, 'pagein') / interval,
+                'pageout': diff(cur, old, 'pageout') / interval}
+        return ret
+
+    def __str__(self):
+        ret = "cache   available ratio    count unitsize\n"
+        ec = self.entrycache
+        count = ec.get('count', 0)
+        size = 0
+        if count:
+            size = ec.get('current', 0) / count
+        ret += "entry % 11d   % 3d % 8d % 5d" % (
+            ec.get('max', 0) - ec.get('current', 0), ec.get('hitratio', 0),
+            count, size)
+        dc = self.dncache
+        if dc.get('max'):
+            count = dc.get('count', 0)
+            size = 0
+            if count:
+                size = dc.get('current', 0) / count
+            ret += "\ndn    % 11d   % 3d % 8d % 5d" % (
+                dc['max'] - dc.get('current', 0),
+                DBStats.ratio(dc.get('hits', 0), dc.get('tries', 0)),
+                count, size)
+
+        if self.hashtables:
+            ret += "\n\n" + self.hashtables
+
+        # global db stats
+        ret += "\n\nglobal db stats\n"
+        cols = [('hits', 'cachehits'), ('tries', 'cachetries'),
+                ('hitratio', 'ratio'), ('pagein', 'pagein'),
+                ('pageout', 'pageout'), ('roevict', 'roevict'),
+                ('rwevict', 'rwevict')]
+        ret += DBStats.table(cols, [self.dbcache])
+
+        # other db stats - the rates are already in the global db stats
+        skips = ('cache-hit', 'cache-try', 'page-write-rate', 'page-read-rate',
+                 'page-ro-evict-rate', 'page-rw-evict-rate')
+        hline = ''  # header line
+        vline = ''  # val line
+        for short in sorted(self.db.keys()):
+            if short in skips:
+                continue
+            val = str(self.db[short])
+            width = max(len(short), len(val))
+            if len(hline) + width > 70:
+                ret += "\n" + hline + "\n" + vline
+                hline = vline = ''
+            hline += ' %*s' % (width, short)
+            vline += ' %*s' % (width, val)
+        if hline:
+            ret += "\n" + hline + "\n" + vline
+
+        # per file db stats
+        ret += "\n\nper file stats\n"
+        cols = [('name', 'dbfilename'), ('cachehit', 'cachehits'),
+                ('cachemiss', 'cachemisses'), ('pagein', 'pagein'),
+                ('pageout', 'pageout')]
+        rows = []
+        for fname in sorted(self.files.keys()):
+            row = dict(self.files[fname])
+            row['name'] = fname
+            rows.append(row)
+        ret += DBStats.table(cols, rows)
+        return ret
+
+    @staticmethod
+    def table(cols, rows):
+        """format rows (dicts) as a table with a column for each
+        (key, header) in cols, each as wide as its widest value"""
+        widths = []
+        for key, header in cols:
+            width = len(header)
+            for row in rows:
+                width = max(width, len(str(row.get(key, ''))))
+            widths.append(width)
+        lines = [''.join([' %*s' % (width, header)
+                          for (key, header), width in zip(cols, widths)])]
+        for row in rows:
+            lines.append(''.join([' %*s' % (width, row.get(key, ''))
+                                  for (key, header), width in zip(cols, widths)]))
+        return '\n'.join(lines)
 
 
 class DSAdmin(SimpleLDAPObject):
     CFGSUFFIX = "o=NetscapeRoot"
     DEFAULT_USER_ID = "nobody"
+    # instance info found by __initPart2, cached per host:port so that
+    # connecting to the same server again does not redo the searches
+    # and read dse.ldif - see loadInstInfo
+    INSTFIELDS = ('sroot', 'inst', 'confdir', 'dbdir', 'errlog')
+    INSTCACHE_TTL = 300
+    instcache = {}
+    taskseq = 0
 
     def getDseAttr(self, attrname):
         conffile = self.confdir + '/dse.ldif'
+        # no LDIFIndex - dse.ldif is small and changes on every config write
         try:
             dseldif = LDIFConn(conffile)
             cnconfig = dseldif.get(DN_CONFIG)
@@ -514,6 +1785,8 @@ class DSAdmin(SimpleLDAPObject):
 
         """
         if self.binddn and len(self.binddn) and not hasattr(self, 'sroot'):
+            if self.loadInstInfo():
+                return
             try:
                 ent = self.getEntry(
                     DN_CONFIG, ldap.SCOPE_BASE, '(objectclass=*)',
@@ -551,6 +1824,7 @@ class DSAdmin(SimpleLDAPObject):
                     ldap.SCOPE_BASE, '(objectclass=*)',
                     ['nsslapd-directory'])
                 self.dbdir = os.path.dirname(ent.getValue('nsslapd-directory'))
+                self.saveInstInfo()
             except (ldap.INSUFFICIENT_ACCESS, ldap.CONNECT_ERROR, NoSuchEntryError):
                 pass  # usually means
 #                print "ignored exception"
@@ -561,10 +1835,45 @@ class DSAdmin(SimpleLDAPObject):
                 print "caught exception ", e
                 raise
 
+    def loadInstInfo(self):
+        """Set the instance fields filled in by __initPart2 from the
+        instcache if there is a valid entry for this host:port.  An entry
+        is valid for INSTCACHE_TTL seconds, and for a local instance only
+        as long as its config directory still exists.  Return True if the
+        fields were set."""
+        info = DSAdmin.instcache.get(str(self))
+        if not info:
+            return False
+        if time.time() - info['cached'] > DSAdmin.INSTCACHE_TTL or \
+                (self.isLocal and info['confdir'] and
+                 not os.path.isdir(info['confdir'])):
+            del DSAdmin.instcache[str(self)]
+            return False
+        for key in DSAdmin.INSTFIELDS:
+            setattr(self, key, info[key])
+        return True
+
+    def saveInstInfo(self):
+        info = {'cached': time.time()}
+        for key in DSAdmin.INSTFIELDS:
+            info[key] = getattr(self, key, None)
+        DSAdmin.instcache[str(self)] = info
+
+    @staticmethod
+    def clearInstCache(hostport=None):
+        """Forget the cached instance info for hostport ("host:port"), or
+        for all servers if hostport is None"""
+        if hostport:
+            DSAdmin.instcache.pop(hostport, None)
+        else:
+            DSAdmin.instcache.clear()
+
     def __localinit__(self):
         uri = self.toLDAPURL()
 
         SimpleLDAPObject.__init__(self, uri)
+        # the config may have been changed while we were not connected
+        self.configsnap = None
 
         # see if binddn is a dn or a uid that we need to lookup
         if self.binddn and not is_a_dn(self.binddn):
@@ -612,6 +1921,8 @@ class DSAdmin(SimpleLDAPObject):
         #
         self.suffixes = {}
         self.agmt = {}
+        # (cmd, seconds, rc) for each serverCmd call
+        self.cmdtimes = []
         # the real init
         self.__localinit__()
 
@@ -644,6 +1955,55 @@ class DSAdmin(SimpleLDAPObject):
             assert obj[0] is not None, "None entry!"  # TEST CODE
             return obj[0]
 
+    def search_iter(self, base, scope, filterstr='(objectclass=*)', attrlist=None,
+                    attrsonly=0, pagesize=1000, serverctrls=None, timeout=-1):
+        """Generator version of search_s - yield one Entry at a time as the
+        server sends them instead of building the whole result list.
+
+            If pagesize is not 0, the RFC 2696 simple paged results control
+            is added and the search is reissued with the returned cookie
+            until the server says there are no more pages (this is what
+            pgtest.py does by hand).  At most one page is ever outstanding,
+            so memory use does not depend on the size of the result set.
+
+            eg. for ent in conn.search_iter(suffix, ldap.SCOPE_SUBTREE, filt):
+                    print ent.dn
+        """
+        ctrls = list(serverctrls or [])
+        pagectrl = None
+        if pagesize:
+            pagectrl = pagedResultsControl(pagesize, '')
+            ctrls.append(pagectrl)
+        msgid = self.search_ext(base, scope, filterstr, attrlist, attrsonly,
+                                ctrls)
+        # no yield inside try/finally - python 2.4
+        try:
+            while msgid is not None:
+                rtype, rdata, rmsgid, rctrls = self.result3(msgid, 0, timeout)
+                if rtype == ldap.RES_SEARCH_ENTRY:
+                    for ent in rdata:
+                        yield Entry(ent)
+                elif rtype == ldap.RES_SEARCH_REFERENCE:
+                    continue  # referrals are not chased
+                elif rtype == ldap.RES_SEARCH_RESULT:
+                    msgid = None
+                    if not pagectrl:
+                        break
+                    cookie = pagedResultsCookie(rctrls)
+                    if cookie is None:
+                        print "Warning: server %s ignores RFC 2696 control" % self
+                    elif cookie:
+                        pagectrl = pagedResultsControl(pagesize, cookie)
+                        ctrls[-1] = pagectrl
+                        msgid = self.search_ext(base, scope, filterstr,
+                                                attrlist, attrsonly, ctrls)
+        except:
+            # an error, or the caller stopped iterating before the end
+            # (GeneratorExit, python 2.5 and later) - tell the server
+            if msgid is not None:
+                self.abandon(msgid)
+            raise
+
     def __wrapmethods(self):
         """This wraps all methods of SimpleLDAPObject, so that we can intercept
         the methods that deal with entries.  Instead of using a raw list of tuples
@@ -655,6 +2015,15 @@ class DSAdmin(SimpleLDAPObject):
                 setattr(self, name, wrapper(attr, name))
 
     def serverCmd(self, cmd, verbose, timeout=120):
+        """Run the start-slapd or stop-slapd script of the instance and wait
+        until the errors log says the server has started or stopped.  The
+        log is followed with inotify where available, so this returns as
+        soon as the message is written.  For start, in case the log message
+        is missed, the server is also considered started if an anonymous
+        search of the root DSE succeeds - this is only tried once nothing
+        has been written to the log for SERVERCMD_QUIET_TIME seconds, or
+        if the log was rotated or cannot be read.  The time taken is
+        appended to self.cmdtimes as (cmd, seconds, rc)."""
         instanceDir = self.sroot + "/slapd-" + self.inst
         errLog = instanceDir + '/logs/errors'
         if hasattr(self, 'errlog'):
@@ -671,17 +2040,24 @@ class DSAdmin(SimpleLDAPObject):
 
         if "USE_GDB" in os.environ or "USE_VALGRIND" in os.environ:
             timeout = timeout * 3
-        timeout = int(time.time()) + timeout
+        begin = time.time()
+        timeout = begin + timeout
         if cmd == 'stop':
             self.unbind()
-        logfp = open(errLog, 'r')
-        logfp.seek(0, 2)  # seek to end
-        pos = logfp.tell()  # get current position
-        logfp.seek(pos, 0)  # reset the EOF flag
+        try:
+            logfp = LogFollower(errLog)
+        except OSError:
+            logfp = None  # e.g. a new instance - rely on the probe
         rc = os.system(fullCmd)
-        while not done and int(time.time()) < timeout:
-            line = logfp.readline()
-            while not done and line:
+        lastactivity = time.time()
+        lastprobe = 0
+        while not done and time.time() < timeout:
+            lines = []
+            if logfp:
+                lines = logfp.readlines()
+            if lines:
+                lastactivity = time.time()
+            for line in lines:
                 lastLine = line
                 if verbose:
                     print line.strip()
@@ -689,38 +2065,54 @@ class DSAdmin(SimpleLDAPObject):
                     started += 1
                     if started == 2:
                         done = True
+                        break
                 elif line.find("Initialization Failed") >= 0:
                     # sometimes the server fails to start - try again
                     rc = os.system(fullCmd)
                 elif line.find("exiting.") >= 0:
                     # possible transient condition - try again
                     rc = os.system(fullCmd)
-                pos = logfp.tell()
-                line = logfp.readline()
-            if line.find("PR_Bind") >= 0:
+            if not done and lastLine.find("PR_Bind") >= 0:
                 # server port conflicts with another one, just report and punt
                 print lastLine.strip()
                 print "This server cannot be started until the other server on this"
                 print "port is shutdown"
-                done = True
+                break
+            now = time.time()
+            if not done and cmd == 'start' and \
+                    (not logfp or logfp.reopened or now - lastactivity >= SERVERCMD_QUIET_TIME) and \
+                    now - lastprobe >= SERVERCMD_PROBE_INTERVAL:
+                lastprobe = now
+                if isLDAPUp(self.host, self.sslport or self.port, self.sslport):
+                    if verbose:
+                        print "server answers on port", self.sslport or self.port
+                    started = 2
+                    done = True
             if not done:
-                time.sleep(2)
-                logfp.seek(pos, 0)
-        logfp.close()
+                wait = min(SERVERCMD_PROBE_INTERVAL, timeout - time.time())
+                if logfp:
+                    logfp.wait(wait)
+                else:
+                    time.sleep(max(0, wait))
+        if logfp:
+            logfp.close()
+        elapsed = time.time() - begin
         if started < 2:
-            now = int(time.time())
+            now = time.time()
             if now > timeout:
                 print "Probable timeout: timeout=%d now=%d" % (timeout, now)
             if verbose:
                 print "Error: could not %s server %s %s: %d" % (
                     cmd, self.sroot, self.inst, rc)
+            self.cmdtimes.append((cmd, elapsed, 1))
             return 1
         else:
             if verbose:
-                print "%s was successful for %s %s" % (
-                    cmd, self.sroot, self.inst)
+                print "%s was successful for %s %s in %.3f seconds" % (
+                    cmd, self.sroot, self.inst, elapsed)
             if cmd == 'start':
                 self.__localinit__()
+        self.cmdtimes.append((cmd, elapsed, 0))
         return 0
 
     def stop(self, verbose=False, timeout=0):
@@ -778,32 +2170,36 @@ class DSAdmin(SimpleLDAPObject):
         return a 2 tuple (true/false,code) first is false if task is running, true if
         done - if true, second is the exit code - if dowait is True, this function
         will block until the task is complete'''
-        attrlist = ['nsTaskLog', 'nsTaskStatus', 'nsTaskExitCode',
-                    'nsTaskCurrentItem', 'nsTaskTotalItems']
-        done = False
-        exitCode = 0
-        dn = entry.dn
-        while not done:
-            entry = self.getEntry(
-                dn, ldap.SCOPE_BASE, "(objectclass=*)", attrlist)
-            if verbose:
-                print entry
-            if entry.nsTaskExitCode:
-                exitCode = int(entry.nsTaskExitCode)
-                done = True
-            if dowait:
-                time.sleep(1)
-            else:
-                break
-        return (done, exitCode)
+        task = Task(self, entry)
+        if dowait:
+            task.wait(verbose=verbose)
+        else:
+            task.poll(verbose)
+        return (task.done(), task.exitcode or 0)
 
     def startTaskAndWait(self, entry, verbose=False):
-        self.startTask(entry, verbose)
-        (done, exitCode) = self.checkTask(entry, True, verbose)
-        return exitCode
+        task = self.launchTask(entry, verbose)
+        return task.wait(verbose=verbose)
+
+    def launchTask(self, entry, verbose=False):
+        """add the task entry and return a Task handle for it without
+        waiting for it to finish"""
+        task = Task(self, entry)
+        task.start(verbose)
+        return task
 
-    def importLDIF(self, ldiffile, suffix, be=None, verbose=False):
-        cn = "import" + str(int(time.time()))
+    @staticmethod
+    def taskCN(prefix):
+        """a task name that is unique even when several tasks of the same
+        kind are started in the same second"""
+        DSAdmin.taskseq += 1
+        return "%s%d_%d" % (prefix, int(time.time()), DSAdmin.taskseq)
+
+    def importLDIF(self, ldiffile, suffix, be=None, verbose=False, wait=True):
+        """import ldiffile into the backend be, or the backend of suffix -
+        return the task exit code, or if wait is False, the Task handle of
+        the running task"""
+        cn = DSAdmin.taskCN("import")
         dn = "cn=%s,cn=import,cn=tasks,cn=config" % cn
         entry = Entry(dn)
         entry.setValues('objectclass', 'top', 'extensibleObject')
@@ -814,6 +2210,8 @@ class DSAdmin(SimpleLDAPObject):
         else:
             entry.setValues('nsIncludeSuffix', suffix)
 
+        if not wait:
+            return self.launchTask(entry, verbose)
         rc = self.startTaskAndWait(entry, verbose)
 
         if rc:
@@ -826,8 +2224,9 @@ class DSAdmin(SimpleLDAPObject):
                     cn, ldiffile)
         return rc
 
-    def exportLDIF(self, ldiffile, suffix, be=None, forrepl=False, verbose=False):
-        cn = "export" + str(int(time.time()))
+    def exportLDIF(self, ldiffile, suffix, be=None, forrepl=False, verbose=False, wait=True):
+        """see importLDIF"""
+        cn = DSAdmin.taskCN("export")
         dn = "cn=%s,cn=export,cn=tasks,cn=config" % cn
         entry = Entry(dn)
         entry.setValues('objectclass', 'top', 'extensibleObject')
@@ -840,6 +2239,8 @@ class DSAdmin(SimpleLDAPObject):
         if forrepl:
             entry.setValues('nsExportReplica', 'true')
 
+        if not wait:
+            return self.launchTask(entry, verbose)
         rc = self.startTaskAndWait(entry, verbose)
 
         if rc:
@@ -852,9 +2253,38 @@ class DSAdmin(SimpleLDAPObject):
                     cn, ldiffile)
         return rc
 
-    def createIndex(self, suffix, attr, verbose=False):
+    def importLDIFs(self, befiles, maxtasks=4, verbose=False):
+        """Import each (backend, ldiffile) in befiles, with at most maxtasks
+        import tasks running at once.  Return the Tasks in the order of
+        befiles - the exitcode, rate() (entries/sec) and elapsed() (wall
+        time) of each give the result for that backend.  If verbose, the
+        stats are printed at the end - see printTaskStats"""
+        def launch(be, ldiffile):
+            task = self.importLDIF(ldiffile, '', be, verbose, False)
+            task.name = be
+            return task
+        start = time.time()
+        tasks = runTasks(launch, befiles, maxtasks, verbose)
+        if verbose:
+            printTaskStats(tasks, time.time() - start)
+        return tasks
+
+    def exportLDIFs(self, befiles, maxtasks=4, forrepl=False, verbose=False):
+        """Export each (backend, ldiffile) in befiles - see importLDIFs"""
+        def launch(be, ldiffile):
+            task = self.exportLDIF(ldiffile, '', be, forrepl, verbose, False)
+            task.name = be
+            return task
+        start = time.time()
+        tasks = runTasks(launch, befiles, maxtasks, verbose)
+        if verbose:
+            printTaskStats(tasks, time.time() - start)
+        return tasks
+
+    def createIndex(self, suffix, attr, verbose=False, wait=True):
+        """see importLDIF"""
         entries_backend = self.getBackendsForSuffix(suffix, ['cn'])
-        cn = "index%d" % time.time()
+        cn = DSAdmin.taskCN("index")
         dn = "cn=%s,cn=index,cn=tasks,cn=config" % cn
         entry = Entry(dn)
         entry.update({
@@ -864,20 +2294,23 @@ class DSAdmin(SimpleLDAPObject):
             'nsInstance': entries_backend[0].cn
         })
         # assume 1 local backend
+        if not wait:
+            return self.launchTask(entry, verbose)
         rc = self.startTaskAndWait(entry, verbose)
 
         if rc:
             if verbose:
-                print "Error: index task %s for file %s exited with %d" % (
-                    cn, ldiffile, rc)
+                print "Error: index task %s for attribute %s exited with %d" % (
+                    cn, attr, rc)
         else:
             if verbose:
-                print "Index task %s for file %s completed successfully" % (
-                    cn, ldiffile)
+                print "Index task %s for attribute %s completed successfully" % (
+                    cn, attr)
         return rc
 
-    def fixupMemberOf(self, suffix, filt=None, verbose=False):
-        cn = "fixupmemberof" + str(int(time.time()))
+    def fixupMemberOf(self, suffix, filt=None, verbose=False, wait=True):
+        """see importLDIF"""
+        cn = DSAdmin.taskCN("fixupmemberof")
         dn = "cn=%s,cn=memberOf task,cn=tasks,cn=config" % cn
         entry = Entry(dn)
         entry.setValues('objectclass', 'top', 'extensibleObject')
@@ -885,6 +2318,8 @@ class DSAdmin(SimpleLDAPObject):
         entry.setValues('basedn', suffix)
         if filt:
             entry.setValues('filter', filt)
+        if not wait:
+            return self.launchTask(entry, verbose)
         rc = self.startTaskAndWait(entry, verbose)
 
         if rc:
@@ -895,35 +2330,55 @@ class DSAdmin(SimpleLDAPObject):
                 print "fixupMemberOf task %s for basedn %s completed successfully" % (cn, suffix)
         return rc
 
-    def addLDIF(self, input_file, cont=False):
-        class LDIFAdder(ldif.LDIFParser):
-            def __init__(self, input_file, conn, cont=False,
-                         ignored_attr_types=None, max_entries=0, process_url_schemes=None
-                         ):
-                myfile = input_file
-                if isinstance(input_file, basestring):
-                    myfile = open(input_file, "r")
-                self.conn = conn
-                self.cont = cont
-                ldif.LDIFParser.__init__(self, myfile, ignored_attr_types,
-                                         max_entries, process_url_schemes)
-                self.parse()
-                if isinstance(input_file, basestring):
-                    myfile.close()
-
-            def handle(self, dn, entry):
-                if not dn:
-                    dn = ''
-                newentry = Entry((dn, entry))
-                try:
-                    self.conn.add_s(newentry)
-                except ldap.LDAPError, e:
-                    if not self.cont:
-                        raise e
-                    print "Error: could not add entry %s: error %s" % (
-                        dn, str(e))
+    def addLDIF(self, input_file, cont=False, window=100, verbose=False):
+        """Add the entries in input_file, keeping up to window add
+        requests outstanding - see LDIFAdder"""
+        adder = LDIFAdder(input_file, self, cont, window, verbose=verbose)
+        return adder.nerrors
+
+    def getConfigSnapshot(self):
+        """Return the ConfigSnapshot of this server, reading a new one if
+        there is none yet, DSAdmin has changed the config since it was
+        taken, or it is found to be out of date - which is checked at most
+        every CONFIG_SNAPSHOT_CHECK_INTERVAL seconds"""
+        snap = self.configsnap
+        if snap and time.time() - snap.checked > CONFIG_SNAPSHOT_CHECK_INTERVAL \
+                and not snap.isCurrent():
+            snap = None
+        if not snap:
+            snap = self.configsnap = ConfigSnapshot(self)
+        return snap
+
+    def configChanged(self, dn):
+        """Drop the config snapshot if dn is in one of the subtrees it was
+        read from"""
+        if not self.configsnap or not dn:
+            return
+        ndn = normalizeDN(dn)
+        for base in CONFIG_SNAPSHOT_BASES:
+            nbase = normalizeDN(base)
+            if ndn == nbase or ndn.endswith(',' + nbase):
+                self.configsnap = None
+                return
+
+    # all adds, modifies, deletes and renames go through these - drop the
+    # config snapshot when they change an entry it was read from
+    def add_ext(self, dn, *args, **kwargs):
+        self.configChanged(dn)
+        return SimpleLDAPObject.add_ext(self, dn, *args, **kwargs)
+
+    def modify_ext(self, dn, *args, **kwargs):
+        self.configChanged(dn)
+        return SimpleLDAPObject.modify_ext(self, dn, *args, **kwargs)
+
+    def delete_ext(self, dn, *args, **kwargs):
+        self.configChanged(dn)
+        return SimpleLDAPObject.delete_ext(self, dn, *args, **kwargs)
 
-        adder = LDIFAdder(input_file, self, cont)
+    def rename(self, dn, newrdn, newsuperior=None, *args, **kwargs):
+        self.configChanged(dn)
+        self.configChanged(newsuperior)
+        return SimpleLDAPObject.rename(self, dn, newrdn, newsuperior, *args, **kwargs)
 
     def getSuffixes(self):
         ents = self.search_s(DN_MAPPING_TREE, ldap.SCOPE_ONELEVEL)
@@ -1043,11 +2498,9 @@ class DSAdmin(SimpleLDAPObject):
         nparent = ""
         if parent:
             nparent = normalizeDN(parent)
-        filt = suffixfilt(suffix)
         # if suffix exists, return
         try:
-            entry = self.getEntry(
-                DN_MAPPING_TREE, ldap.SCOPE_SUBTREE, filt)
+            entry = self.getMTEntry(suffix)
             if verbose:
                 print entry
             return rc
@@ -1085,44 +2538,43 @@ class DSAdmin(SimpleLDAPObject):
         return rc
 
     def getMTEntry(self, suffix, attrs=None):
-        """Given a suffix, return the mapping tree entry for it.  If attrs is
-        given, only fetch those attributes, otherwise, get all attributes.
+        """Given a suffix, return (a copy of) the mapping tree entry for it,
+        from the config snapshot - attrs is ignored, the entry has all
+        attributes.
         """
-        attrs = attrs or []
-        filtr = suffixfilt(suffix)
-        try:
-            entry = self.getEntry(
-                DN_MAPPING_TREE, ldap.SCOPE_ONELEVEL, filtr, attrs)
-            return entry
-        except NoSuchEntryError:
+        entry = self.getConfigSnapshot().mtents.get(normalizeDN(suffix))
+        if not entry:
             raise NoSuchEntryError(
                 "Cannot find suffix in mapping tree: %r " % suffix)
-        except ldap.FILTER_ERROR, e:
-            print "Error searching for", filt
-            raise e
+        return entry.copy()
 
     def getBackendsForSuffix(self, suffix, attrs=None):
-        # TESTME removed try..except and raise if NoSuchEntryError
-        attrs = attrs or []
-        nsuffix = normalizeDN(suffix)
-        entries = self.search_s("cn=plugins,cn=config", ldap.SCOPE_SUBTREE,
-                                "(&(objectclass=nsBackendInstance)(|(nsslapd-suffix=%s)(nsslapd-suffix=%s)))" % (suffix, nsuffix),
-                                attrs)
-        return entries
+        """Return the list of backend entries for suffix, copied from the
+        config snapshot - attrs is ignored, the entries have all attributes."""
+        ents = self.getConfigSnapshot().backends.get(normalizeDN(suffix), [])
+        return [ent.copy() for ent in ents]
 
     def getSuffixForBackend(self, bename, attrs=None):
         """Return the mapping tree entry of `bename` or None if not found"""
-        attrs = attrs or []
+        entry = self.getConfigSnapshot().benames.get(bename.lower())
         try:
-            entry = self.getEntry("cn=plugins,cn=config", ldap.SCOPE_SUBTREE,
-                                  "(&(objectclass=nsBackendInstance)(cn=%s))" % bename,
-                                  ['nsslapd-suffix'])
+            if not entry:
+                raise NoSuchEntryError("no backend %s" % bename)
             suffix = entry.getValue('nsslapd-suffix')
             return self.getMTEntry(suffix, attrs)
         except NoSuchEntryError:
             print "Could not find an entry for backend", bename
             return None
 
+    def getIndexEnts(self, suffix):
+        """Return a dict of lower case attribute name -> index entry (a
+        copy) for the (first) backend of suffix"""
+        entries_backend = self.getBackendsForSuffix(suffix)
+        if not entries_backend:
+            return {}
+        indexes = self.getConfigSnapshot().indexes.get(entries_backend[0].cn.lower(), {})
+        return dict([(attr, ent.copy()) for attr, ent in indexes.items()])
+
     def findParentSuffix(self, suffix):
         """see if the given suffix has a parent suffix"""
         rdns = ldap.explode_dn(suffix)
@@ -1168,144 +2620,26 @@ class DSAdmin(SimpleLDAPObject):
 
         return 0
 
-    def getDBStats(self, suffix, bename=''):
+    def getDBStatsSnapshot(self, suffix, bename=''):
+        """Return a DBStats snapshot of the database monitor entries for
+        the backend bename, or the (first) backend of suffix"""
         if bename:
-            dn = ','.join("cn=monitor,cn=%s" % bename, DN_LDBM)
+            dn = ','.join(["cn=monitor,cn=%s" % bename, DN_LDBM])
         else:
             entries_backend = self.getBackendsForSuffix(suffix)
             dn = "cn=monitor," + entries_backend[0].dn
         dbmondn = "cn=monitor," + DN_LDBM
         dbdbdn = "cn=database,cn=monitor," + DN_LDBM
+        # entrycache and dncache stats
+        ent = self.getEntry(dn, ldap.SCOPE_BASE)
+        monent = self.getEntry(dbmondn, ldap.SCOPE_BASE)
+        dbdbent = self.getEntry(dbdbdn, ldap.SCOPE_BASE)
+        return DBStats(ent, monent, dbdbent)
+
+    def getDBStats(self, suffix, bename=''):
+        """Return the database stats as a text table - see DBStats"""
         try:
-            # entrycache and dncache stats
-            ent = self.getEntry(dn, ldap.SCOPE_BASE)
-            monent = self.getEntry(dbmondn, ldap.SCOPE_BASE)
-            dbdbent = self.getEntry(dbdbdn, ldap.SCOPE_BASE)
-            ret = "cache   available ratio    count unitsize\n"
-            mecs = ent.maxentrycachesize or "0"
-            cecs = ent.currententrycachesize or "0"
-            rem = int(mecs) - int(cecs)
-            ratio = ent.entrycachehitratio or "0"
-            ratio = int(ratio)
-            count = ent.currententrycachecount or "0"
-            count = int(count)
-            if count:
-                size = int(cecs) / count
-            else:
-                size = 0
-            ret += "entry % 11d   % 3d % 8d % 5d" % (rem, ratio, count, size)
-            if ent.maxdncachesize:
-                mdcs = ent.maxdncachesize or "0"
-                cdcs = ent.currentdncachesize or "0"
-                rem = int(mdcs) - int(cdcs)
-                dct = ent.dncachetries or "0"
-                tries = int(dct)
-                if tries:
-                    ratio = (100 * int(ent.dncachehits)) / tries
-                else:
-                    ratio = 0
-                count = ent.currentdncachecount or "0"
-                count = int(count)
-                if count:
-                    size = int(cdcs) / count
-                else:
-                    size = 0
-                ret += "\ndn    % 11d   % 3d % 8d % 5d" % (
-                    rem, ratio, count, size)
-
-            if ent.hasAttr('entrycache-hashtables'):
-                ret += "\n\n" + ent.getValue('entrycache-hashtables')
-
-            # global db stats
-            ret += "\n\nglobal db stats"
-            dbattrs = 'dbcachehits dbcachetries dbcachehitratio dbcachepagein dbcachepageout dbcacheroevict dbcacherwevict'.split(' ')
-            cols = {'dbcachehits': [len('cachehits'), 'cachehits'], 'dbcachetries': [10, 'cachetries'],
-                    'dbcachehitratio': [5, 'ratio'], 'dbcachepagein': [6, 'pagein'],
-                    'dbcachepageout': [7, 'pageout'], 'dbcacheroevict': [7, 'roevict'],
-                    'dbcacherwevict': [7, 'rwevict']}
-            dbrec = {}
-            for attr, vals in monent.iterAttrs():
-                if attr.startswith('dbcache'):
-                    val = vals[0]
-                    dbrec[attr] = val
-                    vallen = len(val)
-                    if vallen > cols[attr][0]:
-                        cols[attr][0] = vallen
-            # construct the format string based on the field widths
-            fmtstr = ''
-            ret += "\n"
-            for attr in dbattrs:
-                fmtstr += ' %%(%s)%ds' % (attr, cols[attr][0])
-                ret += ' %*s' % tuple(cols[attr])
-            ret += "\n" + (fmtstr % dbrec)
-
-            # other db stats
-            skips = {'nsslapd-db-cache-hit': 'nsslapd-db-cache-hit', 'nsslapd-db-cache-try': 'nsslapd-db-cache-try',
-                     'nsslapd-db-page-write-rate': 'nsslapd-db-page-write-rate',
-                     'nsslapd-db-page-read-rate': 'nsslapd-db-page-read-rate',
-                     'nsslapd-db-page-ro-evict-rate': 'nsslapd-db-page-ro-evict-rate',
-                     'nsslapd-db-page-rw-evict-rate': 'nsslapd-db-page-rw-evict-rate'}
-
-            hline = ''  # header line
-            vline = ''  # val line
-            for attr, vals in dbdbent.iterAttrs():
-                if attr in skips:
-                    continue
-                if attr.startswith('nsslapd-db-'):
-                    short = attr.replace('nsslapd-db-', '')
-                    val = vals[0]
-                    width = max(len(short), len(val))
-                    if len(hline) + width > 70:
-                        ret += "\n" + hline + "\n" + vline
-                        hline = vline = ''
-                    hline += ' %*s' % (width, short)
-                    vline += ' %*s' % (width, val)
-
-            # per file db stats
-            ret += "\n\nper file stats"
-            # key is number
-            # data is dict - key is attr name without the number - val is the attr val
-            dbrec = {}
-            dbattrs = ['dbfilename', 'dbfilecachehit',
-                       'dbfilecachemiss', 'dbfilepagein', 'dbfilepageout']
-            # cols maps dbattr name to column header and width
-            cols = {'dbfilename': [len('dbfilename'), 'dbfilename'], 'dbfilecachehit': [9, 'cachehits'],
-                    'dbfilecachemiss': [11, 'cachemisses'], 'dbfilepagein': [6, 'pagein'],
-                    'dbfilepageout': [7, 'pageout']}
-            for attr, vals in ent.iterAttrs():
-                match = DBMONATTRRE.match(attr)
-                if match:
-                    name = match.group(1)
-                    num = match.group(2)
-                    val = vals[0]
-                    if name == 'dbfilename':
-                        val = val.split('/')[-1]
-                    dbrec.setdefault(num, {})[name] = val
-                    vallen = len(val)
-                    if vallen > cols[name][0]:
-                        cols[name][0] = vallen
-                match = DBMONATTRRESUN.match(attr)
-                if match:
-                    name = match.group(1)
-                    if name == 'entrycache':
-                        continue
-                    num = match.group(2)
-                    val = vals[0]
-                    if name == 'dbfilename':
-                        val = val.split('/')[-1]
-                    dbrec.setdefault(num, {})[name] = val
-                    vallen = len(val)
-                    if vallen > cols[name][0]:
-                        cols[name][0] = vallen
-            # construct the format string based on the field widths
-            fmtstr = ''
-            ret += "\n"
-            for attr in dbattrs:
-                fmtstr += ' %%(%s)%ds' % (attr, cols[attr][0])
-                ret += ' %*s' % tuple(cols[attr])
-            for dbf in dbrec.itervalues():
-                ret += "\n" + (fmtstr % dbf)
-            return ret
+            return str(self.getDBStatsSnapshot(suffix, bename))
         except Exception, e:
             print "caught exception", str(e)
         return ''
@@ -1361,6 +2695,10 @@ class DSAdmin(SimpleLDAPObject):
         entries_backend = self.getBackendsForSuffix(suffix, ['cn'])
         # assume 1 local backend
         dn = "cn=%s,cn=index,%s" % (attr, entries_backend[0].dn)
+        if attr.lower() in self.getIndexEnts(suffix):
+            print "Index for attr %s for backend %s already exists" % (
+                attr, dn)
+            return
         entry = Entry(dn)
         entry.setValues('objectclass', 'top', 'nsIndex')
         entry.setValues('cn', attr)
@@ -1377,9 +2715,13 @@ class DSAdmin(SimpleLDAPObject):
     def modIndex(self, suffix, attr, mod):
         """just a wrapper around a plain old ldap modify, but will
         find the correct index entry based on the suffix and attribute"""
-        entries_backend = self.getBackendsForSuffix(suffix, ['cn'])
-        # assume 1 local backend
-        dn = "cn=%s,cn=index,%s" % (attr, entries_backend[0].dn)
+        indexent = self.getIndexEnts(suffix).get(attr.lower())
+        if indexent:
+            dn = indexent.dn
+        else:
+            entries_backend = self.getBackendsForSuffix(suffix, ['cn'])
+            # assume 1 local backend
+            dn = "cn=%s,cn=index,%s" % (attr, entries_backend[0].dn)
         self.modify_s(dn, mod)
 
     def requireIndex(self, suffix):
@@ -1876,12 +3218,13 @@ class DSAdmin(SimpleLDAPObject):
             If suffix is None, all replica entries under mapping tree
             are retrieved.
         """
+        replicas = self.getConfigSnapshot().replicas
         if suffix:
-            filt = "(&(objectclass=nsds5Replica)(nsds5replicaroot=%s))" % suffix
-        else:
-            filt = "(objectclass=nsds5Replica)"
-        ents = self.search_s(DN_MAPPING_TREE, ldap.SCOPE_SUBTREE, filt)
-        return ents
+            ent = replicas.get(normalizeDN(suffix))
+            if ent:
+                return [ent.copy()]
+            return []
+        return [ent.copy() for ent in replicas.values()]
 
     def getReplStatus(self, agmtdn):
         attrlist = ['cn', 'nsds5BeginReplicaRefresh', 'nsds5replicaUpdateInProgress',
@@ -1928,11 +3271,18 @@ class DSAdmin(SimpleLDAPObject):
     def getChangesSent(self, agmtdn):
         ent = self.getEntry(agmtdn, ldap.SCOPE_BASE, "(objectclass=*)",
                             ['nsds5replicaChangesSentSinceStartup'])
-        retval = 0
         if not ent:
             print "Error reading status from agreement", agmtdn
-        elif ent.nsds5replicaChangesSentSinceStartup:
-            val = ent.nsds5replicaChangesSentSinceStartup
+            return 0
+        return DSAdmin.parseChangesSent(ent.nsds5replicaChangesSentSinceStartup)
+
+    @staticmethod
+    def parseChangesSent(val):
+        """return the total number of changes sent from the value of
+        nsds5replicaChangesSentSinceStartup - either a number, or a list of
+        rid:sent/skipped items"""
+        retval = 0
+        if val:
             items = val.split(' ')
             if len(items) == 1:
                 retval = int(items[0])
@@ -2206,10 +3556,8 @@ class DSAdmin(SimpleLDAPObject):
         self.start(True)
 
     def getRUV(self, suffix, tryrepl=False, verbose=False):
-        uuid = "ffffffff-ffffffff-ffffffff-ffffffff"
-        filt = "(&(nsUniqueID=%s)(objectclass=nsTombstone))" % uuid
-        attrs = ['nsds50ruv', 'nsruvReplicaLastModified']
-        ents = self.search_s(suffix, ldap.SCOPE_SUBTREE, filt, attrs)
+        attrs = RUV_ATTRS
+        ents = self.search_s(suffix, ldap.SCOPE_SUBTREE, RUV_FILTER, attrs)
         ent = None
         if ents and (len(ents) > 0):
             ent = ents[0]
@@ -2426,6 +3774,7 @@ class DSAdmin(SimpleLDAPObject):
     @staticmethod
     def cgiFake(sroot, verbose, prog, args):
         """Run the local program prog as a CGI using the POST method."""
+        import urllib  # only needed for the CGI helpers
         content = urllib.urlencode(args)
         length = len(content)
         # setup CGI environment
@@ -2561,6 +3910,9 @@ SchemaFile= %s
             causing Apache to give us a 400 Bad Request error for the
             Authentication string.  So, we have to tell 
             base64.encodestring() not to truncate."""
+        # urllib2 pulls in httplib etc. - only import it when needed
+        import urllib
+        import urllib2
         args = args or {}
         prefix = 'http'
         if secure:
@@ -2767,8 +4119,296 @@ SchemaFile= %s
         return conn
 
 
+class DSAdminPool(object):
+    """A pool of bound DSAdmin connections to one server, shared by worker
+    threads so that each task does not pay for a new connection, bind and
+    the cn=config searches done by DSAdmin.__init__.
+
+        pool = DSAdminPool(host, port, binddn, bindpw, size=8)
+        conn = pool.get()
+        try:
+            ents = conn.search_s(...)
+        finally:
+            pool.put(conn)
+        # or
+        ents = pool.run(lambda conn: conn.search_s(...))
+
+        At most size connections are created, and get() waits for one to
+        be returned if they are all in use (raises Error after timeout
+        seconds if timeout is given).  If healthcheck is True, each
+        connection is checked on checkout with a cheap search of the root
+        DSE, and reconnected and rebound if the server went away (e.g. was
+        restarted).  Pass broken=True to put() to drop a connection that
+        should not be reused.  stats() returns the counters.
+    """
+
+    def __init__(self, host, port=389, binddn='', bindpw='', size=4,
+                 sslport=0, healthcheck=True, verbose=False):
+        self.host = host
+        self.port = port
+        self.binddn = binddn
+        self.bindpw = bindpw
+        self.sslport = sslport
+        self.size = size
+        self.healthcheck = healthcheck
+        self.verbose = verbose
+        self.cond = threading.Condition()
+        self.idle = []
+        self.nconns = 0  # idle + checked out
+        self.closed = False
+        self.counters = {'checkouts': 0, 'created': 0, 'reconnects': 0,
+                         'dropped': 0, 'waits': 0, 'waittime': 0.0,
+                         'maxwait': 0.0}
+
+    def __str__(self):
+        return "pool %s:%s" % (self.host, self.port)
+
+    def connect(self):
+        conn = DSAdmin(self.host, self.port, self.binddn, self.bindpw,
+                       sslport=self.sslport, verbose=self.verbose)
+        self.count('created')
+        return conn
 
+    def count(self, name, val=1):
+        self.cond.acquire()
+        try:
+            self.counters[name] += val
+        finally:
+            self.cond.release()
 
+    def check(self, conn):
+        """return conn if it still works, after reconnecting it if not"""
+        try:
+            conn.search_s('', ldap.SCOPE_BASE, '(objectclass=*)', ['1.1'])
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            if self.verbose:
+                print "reconnecting %s" % conn
+            conn.__localinit__()
+            self.count('reconnects')
+        return conn
+
+    def get(self, timeout=None):
+        start = time.time()
+        conn = None
+        self.cond.acquire()
+        try:
+            waited = False
+            while not self.idle and self.nconns >= self.size:
+                if self.closed:
+                    raise Error("%s is closed" % self)
+                waited = True
+                if timeout is None:
+                    self.cond.wait()
+                else:
+                    remaining = start + timeout - time.time()
+                    if remaining <= 0:
+                        raise Error("%s: no connection available after %s seconds" % (self, timeout))
+                    self.cond.wait(remaining)
+            if self.idle:
+                conn = self.idle.pop()
+            else:
+                self.nconns += 1  # reserve a slot for a new connection
+            waittime = time.time() - start
+            self.counters['checkouts'] += 1
+            if waited:
+                self.counters['waits'] += 1
+                self.counters['waittime'] += waittime
+                if waittime > self.counters['maxwait']:
+                    self.counters['maxwait'] = waittime
+        finally:
+            self.cond.release()
+        try:
+            if conn is None:
+                conn = self.connect()
+            elif self.healthcheck:
+                conn = self.check(conn)
+        except:
+            self.drop(conn)
+            raise
+        return conn
+
+    def put(self, conn, broken=False):
+        if not broken:
+            self.cond.acquire()
+            try:
+                if not self.closed:
+                    self.idle.append(conn)
+                    self.cond.notify()
+                    return
+            finally:
+                self.cond.release()
+        self.drop(conn)  # broken, or put back after close()
+
+    def drop(self, conn):
+        """forget about conn and free its slot in the pool"""
+        self.cond.acquire()
+        try:
+            self.nconns -= 1
+            self.counters['dropped'] += 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        if conn is not None:
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+
+    def run(self, func, *args, **kwargs):
+        """call func(conn, *args, **kwargs) with a connection from the pool"""
+        conn = self.get()
+        try:
+            ret = func(conn, *args, **kwargs)
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            self.put(conn, True)
+            raise
+        except:
+            self.put(conn)
+            raise
+        self.put(conn)
+        return ret
+
+    def stats(self):
+        """return a dict of the pool counters plus the current number of
+        idle and in use connections"""
+        self.cond.acquire()
+        try:
+            ret = dict(self.counters)
+            ret['idle'] = len(self.idle)
+            ret['inuse'] = self.nconns - len(self.idle)
+        finally:
+            self.cond.release()
+        return ret
+
+    def close(self):
+        """unbind the idle connections - connections that are checked out
+        are unbound when they are put back, and get() raises Error"""
+        self.cond.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+            self.nconns -= len(idle)
+            self.size = 0
+            self.closed = True
+            self.cond.notifyAll()  # get() raises Error
+        finally:
+            self.cond.release()
+        for conn in idle:
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+
+
+def waitForEntries(servers, dns, timeout=7200, gone=False, mininterval=0.05,
+                   maxinterval=2.0, quiet=True):
+    """Wait until all of dns are visible on all of servers (DSAdmin
+    objects), or if gone is True, until none of them are.  dns is a list
+    of DNs or Entry objects, or a dict mapping each DN to a dict of
+    attribute values the entry must have before it counts as visible
+    (e.g. {dn: {'description': 'new value'}}) - a value may be a list of
+    values, which must all be present.
+
+    Each round sends one onelevel search per server for each distinct
+    parent DN - usually just one - with an OR filter of the RDNs not yet
+    seen on that server.  The searches to all servers are sent before any
+    of the results are read, so the servers are polled in parallel.  The
+    poll interval of a server starts at mininterval and doubles, up to
+    maxinterval, each round that nothing new shows up on it.
+
+    Return a dict of server -> {dn: seconds from the call until the entry
+    was seen (or seen to be gone) on that server, or None if it was not
+    before the timeout}."""
+    start = time.time()
+    if isinstance(dns, dict):
+        expect = dns
+    else:
+        expect = dict.fromkeys(dns)
+    wanted = {}  # normalized dn -> (dn, parent, rdn filter, expected values)
+    attrs = set()
+    for dn, vals in expect.items():
+        if isinstance(dn, Entry):
+            dn = dn.dn
+        rdns = ldap.explode_dn(dn)
+        wanted[normalizeDN(dn)] = (dn, ','.join(rdns[1:]), rdnfilt(rdns[0]), vals or {})
+        attrs.update((vals or {}).keys())
+    attrlist = list(attrs) or ['1.1']
+    times = {}
+    left = {}  # server -> normalized dns not done yet
+    nextpoll = {}
+    interval = {}
+    for srv in servers:
+        times[srv] = dict([(dn, None) for dn, parent, filt, vals in wanted.values()])
+        left[srv] = set(wanted.keys())
+        nextpoll[srv] = 0
+        interval[srv] = mininterval
+
+    def isvisible(ent, vals):
+        for attr, val in vals.items():
+            if isinstance(val, basestring):
+                val = [val]
+            for vv in val:
+                if not ent.hasValueCase(attr, vv):
+                    return False
+        return True
+
+    while [srv for srv in servers if left[srv]] and time.time() < start + timeout:
+        now = time.time()
+        pending = []
+        for srv in servers:
+            if not left[srv] or nextpoll[srv] > now:
+                continue
+            byparent = {}
+            for ndn in left[srv]:
+                dn, parent, filt, vals = wanted[ndn]
+                byparent.setdefault(parent, []).append(filt)
+            for parent, filts in byparent.items():
+                filt = filts[0]
+                if len(filts) > 1:
+                    filt = '(|%s)' % ''.join(filts)
+                msgid = srv.search_ext(parent, ldap.SCOPE_ONELEVEL, filt, attrlist)
+                pending.append((srv, msgid))
+        found = dict([(srv, set()) for srv in servers])
+        for srv, msgid in pending:
+            try:
+                rtype, ents = srv.result(msgid)
+            except ldap.NO_SUCH_OBJECT:
+                ents = []  # the parent is not there yet either
+            for ent in ents:
+                ndn = normalizeDN(ent.dn)
+                if ndn in wanted and isvisible(ent, wanted[ndn][3]):
+                    found[srv].add(ndn)
+        now = time.time()
+        polled = set([srv for srv, msgid in pending])
+        for srv in servers:
+            if srv not in polled:
+                continue
+            if gone:
+                done = left[srv] - found[srv]
+            else:
+                done = left[srv] & found[srv]
+            for ndn in done:
+                times[srv][wanted[ndn][0]] = now - start
+                if not quiet:
+                    print "%s %s on %s after %.3f seconds" % (
+                        wanted[ndn][0], gone and "gone" or "found", srv, now - start)
+            left[srv] -= done
+            if done:
+                interval[srv] = mininterval
+            else:
+                interval[srv] = min(maxinterval, interval[srv] * 2)
+            nextpoll[srv] = now + interval[srv]
+        waiting = [nextpoll[srv] for srv in servers if left[srv]]
+        if waiting:
+            delay = min(min(waiting), start + timeout) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    if not quiet:
+        for srv in servers:
+            if left[srv]:
+                print "waitForEntries timeout for %s: %d of %d entries not %s" % (
+                    srv, len(left[srv]), len(wanted), gone and "gone" or "found")
+    return times
 
 
 def testit():
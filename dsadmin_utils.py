@@ -61,9 +61,69 @@ def suffixfilt(suffix):
     return filt
 
 
+def escapeFiltValue(val):
+    """escape the characters that are special in a search filter value"""
+    for cc in ('\\', '*', '(', ')', '\0'):
+        val = val.replace(cc, '\\%02x' % ord(cc))
+    return val
+
+
+def unescapeDNValue(val):
+    """undo the \\c and \\hh escapes in a DN attribute value"""
+    if val.find('\\') < 0:
+        return val
+    return re.sub(r'\\([0-9a-fA-F]{2}|.)',
+                  lambda mm: len(mm.group(1)) == 2 and chr(int(mm.group(1), 16)) or mm.group(1),
+                  val)
+
+
+def rdnfilt(rdn):
+    """return a search filter that matches the entry with the given rdn
+    e.g. "cn=foo+sn=bar" -> "(&(cn=foo)(sn=bar))" - for a onelevel search
+    of its parent"""
+    avas = ['(%s=%s)' % (attr.strip(), escapeFiltValue(unescapeDNValue(val.strip())))
+            for attr, val in [ava.split('=', 1)
+                              for ava in re.split(r'(?<!\\)\+', rdn)]]
+    if len(avas) == 1:
+        return avas[0]
+    return '(&%s)' % ''.join(avas)
+
+
+def pagedResultsControl(pagesize, cookie=''):
+    """Return a critical RFC 2696 simple paged results request control.
+    python-ldap 2.4 changed the SimplePagedResultsControl constructor - the
+    old one (used in pgtest.py) takes the OID and a (size, cookie) tuple"""
+    from ldap.controls import SimplePagedResultsControl
+    if hasattr(SimplePagedResultsControl, 'controlType'):  # 2.4 and later
+        return SimplePagedResultsControl(True, size=pagesize, cookie=cookie)
+    return SimplePagedResultsControl(ldap.LDAP_CONTROL_PAGE_OID, True,
+                                     (pagesize, cookie))
+
+
+def pagedResultsCookie(serverctrls):
+    """Return the cookie from the paged results response control in
+    serverctrls - '' means no more pages - or None if the server did
+    not send the control back"""
+    for ctrl in serverctrls or []:
+        if ctrl.controlType == ldap.LDAP_CONTROL_PAGE_OID:
+            if hasattr(ctrl, 'cookie'):
+                return ctrl.cookie
+            est, cookie = ctrl.controlValue
+            return cookie
+    return None
+
+
+@static_var("cache", {})
 def isLocalHost(hname):
+    """Return True if hname resolves to an address of this machine.  The
+    answer is cached per hname for the life of the process.  The check is
+    done in-process by binding a socket to the address - only local
+    addresses can be bound - instead of running ifconfig."""
+    if hname in isLocalHost.cache:
+        return isLocalHost.cache[hname]
     # first see if this is a "well known" local hostname
     if hname == 'localhost' or hname == 'localhost.localdomain':
+        isLocalHost.cache[hname] = True
         return True
 
     # first lookup ip addr
@@ -78,22 +138,52 @@ def isLocalHost(hname):
 
     # next, see if this IP addr is one of our
     # local addresses
-    thematch = re.compile('inet addr:' + ipadr)
-    found = False
-    if HASPOPEN:
-        p = Popen(['/sbin/ifconfig', '-a'], stdout=PIPE)
-        child_stdout = p.stdout
-    else:
-        child_stdout, child_stdin = popen2.popen2(['/sbin/ifconfig', '-a'])
-    for line in child_stdout:
-        if re.search(thematch, line):
-            found = True
-            break
-    if HASPOPEN:
-        p.wait()
+    found = isLocalAddr(ipadr)
+    isLocalHost.cache[hname] = found
     return found
 
 
+def isLocalAddr(ipadr):
+    if ipadr.startswith('127.'):
+        return True
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        try:
+            sock.bind((ipadr, 0))
+            return True
+        except socket.error:
+            return False  # EADDRNOTAVAIL - not one of ours
+    finally:
+        sock.close()
+
+
+def isLDAPUp(host, port, secure=False, timeout=1.0):
+    """Return True if an anonymous base search of the root DSE on
+    host:port succeeds - a bare TCP connect is not enough, the port may be
+    open before the server can answer operations.  If secure is True,
+    use ldaps (without checking the server certificate)."""
+    scheme = 'ldap'
+    if secure:
+        scheme = 'ldaps'
+    conn = ldap.initialize('%s://%s:%d' % (scheme, host, int(port)))
+    try:
+        try:
+            conn.set_option(ldap.OPT_NETWORK_TIMEOUT, timeout)
+            conn.set_option(ldap.OPT_TIMEOUT, timeout)
+            if secure:
+                conn.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+            ents = conn.search_st('', ldap.SCOPE_BASE, '(objectclass=*)',
+                                  ['vendorName'], timeout=timeout)
+            return len(ents) > 0
+        except ldap.LDAPError:
+            return False
+    finally:
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+
 def getfqdn(name=''):
     return socket.getfqdn(name)
 
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Compare the memory used by dsadmin.Entry and dsadmin.CompactEntry when
+all of the entries of a big LDIF file are loaded with LDIFConn.
+
+    entrymembench.py [-n 1000000] [-f file.ldif]
+
+If no file is given, a file with -n generated person entries is created in
+/tmp.  Each representation is loaded in a forked child so that the peak RSS
+(ru_maxrss) of one does not hide the other."""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+from argparse import ArgumentParser
+from dsadmin import LDIFConn, Entry, CompactEntry
+
+
+def makeldif(nents):
+    fd, name = tempfile.mkstemp(suffix='.ldif')
+    out = os.fdopen(fd, 'w')
+    for ii in xrange(nents):
+        out.write("""dn: uid=user%d,ou=people,dc=example,dc=com
+objectClass: top
+objectClass: person
+objectClass: organizationalPerson
+objectClass: inetOrgPerson
+uid: user%d
+cn: User %d
+sn: %d
+givenName: User
+mail: user%d@example.com
+telephoneNumber: +1 555 %07d
+
+""" % (ii, ii, ii, ii, ii, ii))
+    out.close()
+    return name
+
+
+def load(ldiffile, clz):
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        start = time.time()
+        conn = LDIFConn(ldiffile, entryclass=clz)
+        elapsed = time.time() - start
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(wfd, "%d %d %f" % (len(conn.dnlist), maxrss, elapsed))
+        os._exit(0)
+    os.close(wfd)
+    result = os.read(rfd, 1024)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    nents, maxrss, elapsed = result.split()
+    return int(nents), int(maxrss), float(elapsed)
+
+
+parser = ArgumentParser()
+parser.add_argument('-n', type=int, help='number of entries to generate', default=1000000)
+parser.add_argument('-f', help='LDIF file to load instead of a generated one')
+args = parser.parse_args()
+
+ldiffile = args.f
+if not ldiffile:
+    print "Generating %d entries" % args.n
+    ldiffile = makeldif(args.n)
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print "%-12s %10s %12s %14s %10s" % ('class', 'entries', 'maxrss KB', 'bytes/entry', 'seconds')
+for clz in (Entry, CompactEntry):
+    nents, maxrss, elapsed = load(ldiffile, clz)
+    perent = 0
+    if nents:
+        perent = (maxrss - baseline) * 1024 / nents
+    print "%-12s %10d %12d %14d %10.2f" % (clz.__name__, nents, maxrss, perent, elapsed)
+
+if not args.f:
+    os.unlink(ldiffile)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Check that the LDIF written by EntryWriter and LDIFPipeline (as used by
+logmon.py to rewrite dse.ldif) reads back with the same values, even though
+importing dsadmin replaces ldif.safe_string_re - values that are binary, or
+have a leading space, a newline, or non-ASCII characters must be base64
+encoded."""
+
+import os
+import ldif
+import tempfile
+import cStringIO
+from dsadmin import EntryWriter, LDIFPipeline
+
+vals = {
+    'nsSymmetricKey': ['\x00\x01\xfe\xff binary\x80'],
+    'description': [' leading space', 'trailing space ', 'two\nlines', ':colon', '<angle'],
+    'cn': ['caf\xc3\xa9', 'plain'],
+    'nsstate': ['forced'],
+}
+dn = 'cn=test,cn=config'
+
+
+def readback(text):
+    recs = ldif.LDIFRecordList(cStringIO.StringIO(text))
+    recs.parse()
+    return recs.all_records
+
+
+def check(name, text):
+    records = readback(text)
+    assert len(records) == 1, "%s: %d records" % (name, len(records))
+    rdn, rvals = records[0]
+    assert rdn == dn, "%s: dn %r" % (name, rdn)
+    for attr, expected in vals.items():
+        assert rvals.get(attr) == expected, "%s: %s is %r not %r" % (
+            name, attr, rvals.get(attr), expected)
+    print name, "ok"
+
+check("EntryWriter.format", EntryWriter(None).format(dn, vals))
+
+fd, inname = tempfile.mkstemp(suffix='.ldif')
+outname = inname + '.out'
+try:
+    os.write(fd, EntryWriter(None).format(dn, vals))
+    os.close(fd)
+    pipe = LDIFPipeline(inname)
+    pipe.map(lambda dn, ent: (dn, ent))
+    pipe.write(outname, 76)
+    pipe.run()
+    check("LDIFPipeline.write", open(outname).read())
+finally:
+    os.unlink(inname)
+    if os.path.exists(outname):
+        os.unlink(outname)
@@ -0,0 +1,215 @@
+"""File utilities that only need the standard library - for scripts that
+do not otherwise use python-ldap (valpyk.py, analyze_strace.py, etc.)
+
+    openInput - open a log or LDIF file for reading, decompressing it on
+    the fly if it is gzip, bzip2 or xz compressed
+    compression - how a file is compressed, for code that needs to seek
+    LogFollower - read the lines appended to a log file, waiting for
+    them with inotify where available
+"""
+try:
+    from subprocess import Popen, PIPE
+    HASPOPEN = True
+except ImportError:
+    HASPOPEN = False
+try:
+    import io
+    HASIO = True
+except ImportError:
+    HASIO = False
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True)
+    HASINOTIFY = hasattr(_libc, 'inotify_init')
+except (ImportError, OSError):
+    HASINOTIFY = False
+
+import os
+import sys
+import time
+import gzip
+import bz2
+import errno
+import select
+
+# read buffer size for openInput
+INPUT_BUFSIZE = 1024 * 1024
+
+GZIP_MAGIC = '\x1f\x8b'
+BZ2_MAGIC = 'BZh'
+XZ_MAGIC = '\xfd7zXZ\x00'
+
+
+class DecompressPipe(object):
+    """Read the output of a decompression command, e.g. xz -dc filename,
+    through a pipe - used for xz when there is no lzma module"""
+
+    def __init__(self, cmd, filename, bufsize=INPUT_BUFSIZE):
+        self.name = filename
+        self.proc = Popen(cmd + [filename], stdout=PIPE, bufsize=bufsize)
+        self.fp = self.proc.stdout
+
+    def __iter__(self):
+        return iter(self.fp)
+
+    def read(self, *args):
+        return self.fp.read(*args)
+
+    def readline(self, *args):
+        return self.fp.readline(*args)
+
+    def close(self):
+        self.fp.close()
+        return self.proc.wait()
+
+
+def buffered(raw, bufsize):
+    if HASIO:
+        return io.BufferedReader(raw, bufsize)
+    return raw
+
+
+def compression(filename):
+    """'gzip', 'bzip2' or 'xz' if filename is compressed - determined by
+    the magic bytes at the start of the file - or None"""
+    if filename == '-':
+        return None
+    fp = open(filename, 'rb')
+    magic = fp.read(len(XZ_MAGIC))
+    fp.close()
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(BZ2_MAGIC):
+        return 'bzip2'
+    if magic.startswith(XZ_MAGIC):
+        return 'xz'
+    return None
+
+
+def openInput(filename, bufsize=INPUT_BUFSIZE):
+    """Open filename for reading.  If the file is gzip, bzip2 or xz
+    compressed - determined by the magic bytes at the start of the file,
+    not by the file name - return a file object that decompresses it as
+    it is read, so rotated logs and LDIF exports do not have to be
+    decompressed to disk first.  Reads use a bufsize buffer.  The returned
+    object supports read, readline, iteration, close and name.
+    A filename of '-' means stdin."""
+    if filename == '-':
+        return sys.stdin
+    kind = compression(filename)
+    if kind == 'gzip':
+        return buffered(gzip.GzipFile(filename, 'rb'), bufsize)
+    if kind == 'bzip2':
+        return bz2.BZ2File(filename, 'r', bufsize)
+    if kind == 'xz':
+        if lzma:
+            return buffered(lzma.LZMAFile(filename, 'rb'), bufsize)
+        return DecompressPipe(['xz', '-dc'], filename, bufsize)
+    return open(filename, 'r', bufsize)
+
+
+# inotify events that mean the followed file has changed
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+FOLLOW_EVENTS = IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+# how often to look at the file when inotify is not available
+FOLLOW_POLL_INTERVAL = 0.1
+
+
+class LogFollower(object):
+    """Follow a log file like tail -f, starting at the current end of the
+    file.  readlines() returns the complete lines written since the last
+    call (a partial last line is kept until its newline arrives), and
+    wait(timeout) blocks until the file changes or timeout seconds have
+    passed.  With inotify (Linux) wait returns as soon as something is
+    written - otherwise it sleeps for FOLLOW_POLL_INTERVAL.  If the log is
+    rotated (the file is replaced or truncated) it is reopened and read
+    from the start."""
+
+    def __init__(self, filename):
+        self.name = filename
+        self.partial = ''
+        self.reopened = 0  # times the file was rotated
+        self.ifd = -1
+        self.open(True)
+        if HASINOTIFY:
+            self.ifd = _libc.inotify_init()
+            if self.ifd >= 0 and _libc.inotify_add_watch(
+                    self.ifd, filename, FOLLOW_EVENTS) < 0:
+                os.close(self.ifd)
+                self.ifd = -1
+
+    def open(self, seekend=False):
+        self.fd = os.open(self.name, os.O_RDONLY)
+        st = os.fstat(self.fd)
+        self.ino = st.st_ino
+        self.pos = 0
+        if seekend:
+            self.pos = os.lseek(self.fd, 0, 2)
+
+    def rotated(self):
+        try:
+            st = os.stat(self.name)
+        except OSError:
+            return False  # gone - keep reading the old file until it is back
+        return st.st_ino != self.ino or st.st_size < self.pos
+
+    def readlines(self):
+        data = []
+        while True:
+            buf = os.read(self.fd, 65536)
+            if not buf:
+                break
+            self.pos += len(buf)
+            data.append(buf)
+        lines = []
+        if data:
+            lines = (self.partial + ''.join(data)).split('\n')
+            self.partial = lines.pop()
+        if self.rotated():
+            # the rest of the old file, then the new one from the start
+            if self.partial:
+                lines.append(self.partial)
+                self.partial = ''
+            os.close(self.fd)
+            self.open()
+            self.reopened += 1
+            return [line + '\n' for line in lines] + self.readlines()
+        return [line + '\n' for line in lines]
+
+    def wait(self, timeout):
+        """wait up to timeout seconds for the file to change - return True
+        if it (probably) has"""
+        if self.ifd < 0:
+            time.sleep(max(0, min(timeout, FOLLOW_POLL_INTERVAL)))
+            return True
+        try:
+            rr, wr, xr = select.select([self.ifd], [], [], max(timeout, 0))
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return True
+            raise
+        if not rr:
+            return False
+        os.read(self.ifd, 4096)  # discard the events
+        if self.rotated():  # the watch went with the old file
+            _libc.inotify_add_watch(self.ifd, self.name, FOLLOW_EVENTS)
+        return True
+
+    def close(self):
+        os.close(self.fd)
+        if self.ifd >= 0:
+            os.close(self.ifd)
+            self.ifd = -1
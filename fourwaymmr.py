@@ -3,7 +3,7 @@ import os
 import sys
 import ldap
 import time
-from dsadmin import DSAdmin, Entry
+from dsadmin import DSAdmin, Entry, waitForEntries
 from subprocess import Popen
 
 host1 = "localhost"
@@ -63,21 +63,12 @@ for xx in srvs:
     ent.setValues('objectclass', 'extensibleObject')
     xx.add_s(ent)
     dns.append(dn)
-    for yy in srvs:
-        while True:
-            try: ents = yy.search_s(dn, ldap.SCOPE_BASE)
-            except ldap.NO_SUCH_OBJECT: ents = None
-            if not ents or len(ents) < 1: time.sleep(1)
-            else: break
+waitForEntries(srvs, dns, quiet=False)
 
 print "delete test entry"
 for (srv, dn) in zip(srvs, dns):
     srv.delete_s(dn)
-    for yy in srvs:
-        while True:
-            try: ents = yy.search_s(dn, ldap.SCOPE_BASE)
-            except ldap.NO_SUCH_OBJECT: break
-            time.sleep(1)
+waitForEntries(srvs, dns, gone=True, quiet=False)
 
 print "mmr is running - begin ldclt"
 WAITTIME=1
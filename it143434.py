@@ -3,7 +3,7 @@ import os
 import sys
 import time
 import ldap
-from dsadmin import DSAdmin, Entry
+from dsadmin import DSAdmin, Entry, waitForEntries
 
 host1 = "localhost.localdomain"
 host2 = host1
@@ -99,14 +99,12 @@ for ii in ments:
     m.add_s(ent)
     print "Added m entry", dn
 
-print "Sleep for 5 seconds to let changes propagate . . ."
-time.sleep(5)
-
-print "see if m entries made it to h"
-for ii in ments:
-    dn = "cn=%d, %s" % (ii, basedn)
-    ent = h.getEntry(dn, ldap.SCOPE_BASE)
-    print "found h entry", dn
+print "wait for m entries to make it to h"
+times = waitForEntries([h], ["cn=%d, %s" % (ii, basedn) for ii in ments], 60)
+if None in times[h].values():
+    print "Error: not all m entries made it to h"
+    sys.exit(1)
+print "all %d m entries found on h after %.3f seconds" % (len(ments), max(times[h].values()))
 
 print "exporting replica init file from h"
 initfile = "/tmp/init.ldif"
@@ -123,14 +121,12 @@ for ii in ments:
     m.add_s(ent)
     print "Added m entry", dn
 
-print "Sleep for 5 seconds to let changes propagate . . ."
-time.sleep(5)
-
-print "see if m entries made it to h"
-for ii in ments:
-    dn = "cn=%d, %s" % (ii, basedn)
-    ent = h.getEntry(dn, ldap.SCOPE_BASE)
-    print "found h entry", dn
+print "wait for m entries to make it to h"
+times = waitForEntries([h], ["cn=%d, %s" % (ii, basedn) for ii in ments], 60)
+if None in times[h].values():
+    print "Error: not all m entries made it to h"
+    sys.exit(1)
+print "all %d m entries found on h after %.3f seconds" % (len(ments), max(times[h].values()))
 
 print "init replica c from the replica init file"
 c.importLDIF(initfile, basedn, None, True)
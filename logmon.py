@@ -4,7 +4,7 @@ import sys
 import os
 import errno
 import time
-import ldif
+from dsadmin import LDIFPipeline
 
 errlogfifo = '/tmp/errlogfifo'
 accesslogfifo = '/tmp/accesslogfifo'
@@ -16,25 +16,9 @@ errorloglevel = '0' # set on command line
 doaccesslog = False
 doauditlog = False
 
-class LDIFFilter(ldif.LDIFCopy):
-  """
-  Copy LDIF input to LDIF output allowing entry mods
-  """
-
-  def __init__(
-    self,
-    input_file,output_file,
-    ignored_attr_types=None,max_entries=0,process_url_schemes=None,
-    base64_attrs=None,cols=76,line_sep='\n'
-  ):
+def fixconfig(dn,entry):
     """
-    See LDIFParser.__init__() and LDIFWriter.__init__()
-    """
-    ldif.LDIFCopy.__init__(self,input_file,output_file,ignored_attr_types,max_entries,process_url_schemes)
-
-  def handle(self,dn,entry):
-    """
-    Write single LDIF record to output file.
+    Point the server logs at the fifos
     """
     if dn == "cn=config":
         entry['nsslapd-errorlog-level'] = [errorloglevel]
@@ -49,7 +33,7 @@ class LDIFFilter(ldif.LDIFCopy):
             entry['nsslapd-auditlog-maxlogsperdir'] = [str(1)]
             entry['nsslapd-auditlog-logging-enabled'] = ['on']
             entry['nsslapd-auditlog'] = [auditlogfifo]
-    self._output_ldif.unparse(dn,entry)
+    return (dn, entry)
 
 
 def save_server_config(instdir):
@@ -65,12 +49,10 @@ def restore_server_config(instdir):
 def change_server_config(instdir):
     dseldif = instdir + "/config/dse.ldif"
     dsesave = instdir + "/config/dse.ldif.save"
-    input = open(dsesave, "r")
-    output = open(dseldif, "w")
-    ldif = LDIFFilter(input, output)
-    ldif.parse()
-    input.close()
-    output.close()
+    pipe = LDIFPipeline(dsesave)
+    pipe.map(fixconfig)
+    pipe.write(dseldif, 76)
+    pipe.run()
 
 def getargs():
     global instdir, maxbufsize, errorloglevel, doaccesslog, doauditlog
@@ -4,7 +4,7 @@ import time
 import ldap
 import tempfile
 import shutil
-from dsadmin import DSAdmin, Entry
+from dsadmin import DSAdmin, Entry, LDIFAdder
 import ldif
 
 print "start"
@@ -30,35 +30,19 @@ memberofgroupattr: uniquemember
 cfgfd.close()
 os.chmod(cfgfd.name, 0644)
 
-def addLDIF(conn, file, cont=False):
-    class LDIFAdder(ldif.LDIFParser):
-        def __init__(self, input_file, conn, cont=False,
-                     ignored_attr_types=None,max_entries=0,process_url_schemes=None
-                     ):
-            myfile = input_file
-            if isinstance(input_file,basestring):
-                myfile = open(input_file, "r")
-            self.conn = conn
-            self.cont = cont
-            ldif.LDIFParser.__init__(self,myfile,ignored_attr_types,max_entries,process_url_schemes)
-            self.parse()
-            if isinstance(input_file,basestring):
-                myfile.close()
-
-        def handle(self,dn,entry):
-            if not dn:
-                dn = ''
-            newentry = Entry((dn, entry))
-            if newentry.hasValueCase('objectclass', 'inetorgperson'):
-                ocvals = newentry.getValues('objectclass')
-                ocvals.append('inetUser')
-                newentry.setValue('objectclass', ocvals)
-            try: self.conn.add_s(newentry)
-            except ldap.LDAPError, e:
-                if not self.cont: raise e
-                print "Error: could not add entry %s: error %s" % (dn, str(e))
+class MemberOfAdder(LDIFAdder):
+    def handle(self,dn,entry):
+        if not dn:
+            dn = ''
+        newentry = Entry((dn, entry))
+        if newentry.hasValueCase('objectclass', 'inetorgperson'):
+            ocvals = newentry.getValues('objectclass')
+            ocvals.append('inetUser')
+            newentry.setValue('objectclass', ocvals)
+        self.add(newentry)
 
-    adder = LDIFAdder(file, conn, cont)        
+def addLDIF(conn, file, cont=False):
+    adder = MemberOfAdder(file, conn, cont)
 
 os.environ['USE_GDB'] = '1'
 ds = DSAdmin.createInstance({
@@ -6,20 +6,12 @@ import os, os.path
 import ldap
 import ldif
 import time
+from dsadmin import LDIFAdder
 from subprocess import Popen, PIPE, STDOUT
 
 def ldapadd(conn, ldiffile):
-    lfd = open(ldiffile)
-    ldrl = ldif.LDIFRecordList(lfd)
-    ldrl.parse()
-    lfd.close()
-    for dn, entry in ldrl.all_records:
-        mylist = []
-        for attr, vals in entry.iteritems():
-            mylist.append((attr, vals))
-        try: conn.add_s(dn, mylist)
-        except ldap.ALREADY_EXISTS: pass
-        except ldap.UNDEFINED_TYPE: pass
+    LDIFAdder(ldiffile, conn, False,
+              ignore=(ldap.ALREADY_EXISTS, ldap.UNDEFINED_TYPE))
 
 def setupserver(rootdir,pwd,ii=0,verbose=False):
     strii = ''
@@ -1,6 +1,13 @@
+try:
+    import multiprocessing
+    HASMP = True
+except ImportError:
+    HASMP = False
+
 import sys
 import re
 import time
+import calendar
 import ldif
 import ldap
 import ldap.sasl
@@ -8,7 +15,9 @@ import ldap.cidict
 import os, os.path
 import pprint
 import StringIO
+from collections import deque
 from operator import itemgetter
+from fileutils import openInput
 
 # regex that matches a BIND request line
 regex_num = r'[-]?\d+' # matches numbers including negative
@@ -35,14 +44,95 @@ regex_srch_res = re.compile(r'^(\[.+\]) (conn=%s) (op=%s) RESULT err=(%s) tag=10
 #[03/Sep/2013:11:16:35 -0400] conn=2467156 op=2 ABANDON targetop=1 msgid=829128 nentries=16 etime=60
 # targetop=NOTFOUND also, that's why it has to be a string, not an int
 regex_abandon = re.compile(r'^(\[.+\]) (conn=%s) (op=%s) ABANDON targetop=(\S+) msgid=(%s) nentries=(%s) etime=(%s)' % (regex_num, regex_num, regex_num, regex_num, regex_num))
-# format for strptime
-ts_fmt_access = '[%d/%b/%Y:%H:%M:%S -0700]'
+# strftime format used by ts2accesstime, which adds the zone - access log
+# timestamps are parsed by slicing in parseaccesstime, not with strptime
+ts_fmt_access = '[%d/%b/%Y:%H:%M:%S]'
+# strptime/strftime formats of audit log times - see audittime2ts
 ts_fmt_audit = '%Y%m%d%H%M%S'
 ts_fmt_auditz = '%Y%m%d%H%M%SZ'
 
+month2num = dict([(name, ii + 1) for ii, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))])
+# how many access log timestamp strings accesstime2ts remembers
+ACCESSTIME_CACHE_SIZE = 4096
+accesstime_cache = {}
+# seconds east of UTC of the zone the (non Z) audit log times are in - None
+# means the local zone of this host
+audit_zone_offset = None
+
+def parsezone(zone):
+    """+HHMM or -HHMM to seconds east of UTC"""
+    if len(zone) != 5 or zone[0] not in '+-':
+        raise ValueError("bad zone %r" % zone)
+    offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+    if zone[0] == '-':
+        offset = -offset
+    return offset
+
+def parseaccesstime(accesstsstr):
+    """[dd/Mon/YYYY:HH:MM:SS +zone] to time_t - the fields are at fixed
+    offsets, and the seconds may have a fraction (ignored)"""
+    try:
+        if accesstsstr[0] != '[' or accesstsstr[-1] != ']':
+            raise ValueError(accesstsstr)
+        offset = parsezone(accesstsstr[accesstsstr.rindex(' ') + 1:-1])
+        ts = calendar.timegm((int(accesstsstr[8:12]), month2num[accesstsstr[4:7]],
+                              int(accesstsstr[1:3]), int(accesstsstr[13:15]),
+                              int(accesstsstr[16:18]), int(accesstsstr[19:21])))
+    except (ValueError, KeyError, IndexError):
+        raise ValueError("time data %r is not an access log timestamp" % accesstsstr)
+    return ts - offset
+
 def accesstime2ts(accesstsstr):
-    utctime = int(time.mktime(time.strptime(accesstsstr, ts_fmt_access)))
-    return int(time.mktime(time.localtime(utctime)))
+    """the time_t of an access log timestamp, using its zone offset - the
+    last ACCESSTIME_CACHE_SIZE timestamp strings are cached, since most
+    lines are in the same second as the line before them"""
+    ts = accesstime_cache.get(accesstsstr)
+    if ts is None:
+        ts = parseaccesstime(accesstsstr)
+        if len(accesstime_cache) >= ACCESSTIME_CACHE_SIZE:
+            accesstime_cache.clear()
+        accesstime_cache[accesstsstr] = ts
+    return ts
+
+def accesslogzone(filename):
+    """the zone offset of the first timestamp in the access log filename,
+    or None if there is none in the first lines"""
+    f = openInput(filename)
+    try:
+        for ii in xrange(0, 100):
+            line = f.readline()
+            if not line:
+                break
+            if line.startswith('[') and ']' in line:
+                try:
+                    return parsezone(line[line.index(' ') + 1:line.index(']')])
+                except ValueError:
+                    pass
+    finally:
+        f.close()
+    return None
+
+def audittime2ts(auditts):
+    """the time_t of an audit log time - YYYYMMDDHHMMSSZ is UTC, and
+    YYYYMMDDHHMMSS is in the zone of the server, audit_zone_offset, or
+    the local zone if that is not known"""
+    if auditts.endswith('Z'):
+        return calendar.timegm(time.strptime(auditts, ts_fmt_auditz))
+    tm = time.strptime(auditts, ts_fmt_audit)
+    if audit_zone_offset is None:
+        return int(time.mktime(tm))
+    return calendar.timegm(tm) - audit_zone_offset
+
+def ts2accesstime(ts):
+    """format a time_t like an access log timestamp, in the local zone"""
+    tm = time.localtime(ts)
+    offset = (calendar.timegm(tm) - int(ts)) / 60
+    sign = '+'
+    if offset < 0:
+        sign = '-'
+        offset = -offset
+    return time.strftime(ts_fmt_access, tm)[:-1] + ' %s%02d%02d]' % (sign, offset / 60, offset % 60)
 
 # extra time to sleep between ops
 extra_sleep_time = 1.0
@@ -121,16 +211,13 @@ class Req(object):
         self.conn = conn
         self.op = op
         if auditts:
-            try:
-                self.auditts = int(time.mktime(time.strptime(auditts, ts_fmt_audit)))
-            except ValueError:
-                self.auditts = int(time.mktime(time.strptime(auditts, ts_fmt_auditz)))-time.timezone
+            self.auditts = audittime2ts(auditts)
         else:
             self.auditts = 0
     def __cmp__(self, oth): return oth.ts - self.ts
     def __eq__(self, oth): return cmp(self, oth) == 0
     def __str__(self):
-        return 'ts=%s auditts=%s %s %s' % (time.strftime(ts_fmt_access, time.localtime(self.ts)),
+        return 'ts=%s auditts=%s %s %s' % (ts2accesstime(self.ts),
                                            time.strftime(ts_fmt_audit, time.localtime(self.auditts)),
                                            self.conn, self.op)
     def __repr__(self): return str(self)
@@ -258,7 +345,7 @@ class Res(object):
         elif fields:
             self.ts, self.conn, self.op, self.errnum = fields
     def __str__(self):
-        return 'RESULT ts=%s %s %s err=%s' % (time.strftime(ts_fmt_access, time.localtime(self.ts)),
+        return 'RESULT ts=%s %s %s err=%s' % (ts2accesstime(self.ts),
                                               self.conn, self.op, self.errnum)
     def __repr__(self): return str(self)
 
@@ -293,6 +380,12 @@ class AbandonRes(Res):
     def __repr__(self): return str(self)
     def targetopid(self): return 'op=%d' % self.targetop
 
+class ClosedRes(Res):
+    """fd=N closed - the "result" of an UNBIND, and the end of the conn"""
+    def __str__(self):
+        return Res.__str__(self) + ' closed'
+    def __repr__(self): return str(self)
+
 class Op(object):
     def __init__(self, req=None, res=None, auditreq=None):
         self.req = req
@@ -303,6 +396,10 @@ class Op(object):
     def __repr__(self): return str(self)
     # a complete op has both a request and a result
     def iscomplete(self): return self.req and self.res
+    # when the op was first seen
+    def firstts(self):
+        if self.req: return self.req.ts
+        return self.res.ts
     def opid(self):
         if self.req: return self.req.op
         if self.res: return self.res.op
@@ -315,10 +412,14 @@ class Conn(object):
         self.slot = slot
         self.ip = ip
         self.timestamp = timestamp
+        self.ts = 0
         if timestamp:
             self.ts = accesstime2ts(timestamp)
         self.binddn = None
-        self.ops = []
+        # key is op=Y, val is the Op - pending has the keys in the order
+        # the ops were seen, which is the order they are replayed in
+        self.ops = {}
+        self.pending = deque()
         self.sslinfo = ''
         url = os.environ.get('LDAPURL', None)
         if url:
@@ -333,17 +434,52 @@ class Conn(object):
         self.sslinfo += sslinfo
 
     def findop(self, opid):
-        for op in self.ops:
-            if op.opid() == opid: return op
-        return None
+        return self.ops.get(opid, None)
+
+    def addop(self, op):
+        opid = op.opid()
+        self.ops[opid] = op
+        self.pending.append(opid)
+
+    def pendingops(self):
+        return [self.ops[opid] for opid in self.pending]
+
+    def dropcomplete(self):
+        """forget the ops at the head of pending that are complete - for
+        stream_mode when the ops are not being replayed"""
+        while self.pending:
+            op = self.ops.get(self.pending[0], None)
+            if op and not op.iscomplete(): break
+            opid = self.pending.popleft()
+            if op:
+                del self.ops[opid]
+                streamstats['ops'] += 1
+
+    def evictops(self, cutoff):
+        """forget the incomplete ops at the head of pending first seen
+        before cutoff - their request or result is never coming"""
+        while self.pending:
+            op = self.ops.get(self.pending[0], None)
+            if op:
+                if op.iscomplete() or op.firstts() >= cutoff: break
+                del self.ops[self.pending[0]]
+                streamstats['evicted'] += 1
+            self.pending.popleft()
+        if self.ld:
+            return self.replayops()
+        self.dropcomplete()
+        return False
 
     def replayops(self):
-        if not self.ld: return False
+        if not self.ld:
+            if stream_mode: self.dropcomplete()
+            return False
         isclosed = False
-        while self.ops:
-            op = self.ops[0]
+        while self.pending:
+            op = self.ops[self.pending[0]]
             if op.iscomplete():
-                op = self.ops.pop(0)
+                del self.ops[self.pending.popleft()]
+                streamstats['ops'] += 1
                 if op.res.errnum in ignore_errors: # don't care about this op
                     pass
                 else:
@@ -363,8 +499,7 @@ class Conn(object):
             op.req = req
             isclosed = self.replayops()
         else: # store request until we get the result
-            op = Op(req=req)
-            self.ops.append(op)
+            self.addop(Op(req=req))
         if isinstance(req,BindReq):
             self.binddn = req.dn
             val = binddns.get(self.binddn, 0) + 1
@@ -385,8 +520,7 @@ class Conn(object):
             if isinstance(res,AbandonRes) and res.targetop >= 0:
                 print str(op)
         else: # store request until we get the result
-            op = Op(res=res)
-            self.ops.append(op)
+            self.addop(Op(res=res))
         return isclosed
 
     def replay(self, op):
@@ -471,6 +605,22 @@ conns = {}
 # key is binddn
 # val is number of times a connection was made which was followed by a bind with that dn
 binddns = {}
+# stream_mode keeps only the conns and ops that are in progress - a conn is
+# retired (see retireConn) when it is closed, after adding its bind to
+# bindsbyts, and incomplete ops are evicted after stale_op_timeout seconds
+stream_mode = False
+stale_op_timeout = 300
+nextsweep = 0
+# key is ts (time_t) of the conn, val is dict of binddn -> number of conns
+# - built from connsbyts, or from the retired conns in stream_mode
+bindsbyts = {}
+# stream_mode without a replay target retires a conn at its UNBIND - key is
+# the conn id, val is the ts of the UNBIND.  Later lines of the conn (e.g.
+# the RESULT of an op in flight) are ignored until its closed line, so that
+# they do not create a dummy conn.  sweepConns expires the ids after
+# stale_op_timeout, in case the closed line never comes
+retiredconns = {}
+streamstats = {'conns': 0, 'ops': 0, 'evicted': 0, 'incomplete': 0, 'maxconns': 0, 'maxops': 0}
 mints = 99999999999
 maxts = 0
 def updateminmaxts(ts):
@@ -706,7 +856,7 @@ regexmap = ((regex_bind_req, BindReq), (regex_bind_res, Res),
             (regex_mdn_req, MdnReq), (regex_mdn_res, Res),
             (regex_del_req, DelReq), (regex_del_res, Res),
             (regex_srch_req, SrchReq), (regex_srch_res, SrchRes),
-            (regex_unbind, UnbindReq), (regex_closed, Res),
+            (regex_unbind, UnbindReq), (regex_closed, ClosedRes),
             (regex_abandon, AbandonRes))
 
 # key is ts (time_t)
@@ -716,32 +866,129 @@ connsbyts = {}
 def tsinrange(ts, begin, end):
     return ts >= begin and ts <= end
 
+class LineMatch(object):
+    """the groups of a line found by classifyAccessLine - looks enough like
+    a re match object for the Req and Res constructors"""
+    def __init__(self, groups):
+        self.fields = groups
+        self.lastindex = len(groups)
+    def groups(self): return self.fields
+
+# the [ts] conn=N op=M prefix common to all access log lines - op is
+# missing from connection lines (new conn, SSL, AUTOBIND)
+regex_prefix = re.compile(r'(\[[^]]*\]) (conn=%s) (?:(op=%s) )?' % (regex_num, regex_num))
+# the rest of the line after the prefix, by the keyword that starts it
+# - the groups are the same as the regex_* patterns for the whole line
+connline_parsers = {
+    'fd': ('conn', re.compile(r'(fd=%s) (slot=%s) (?:SSL )?connection from (\S+)' % (regex_num, regex_num))),
+    'SSL': ('ssl', re.compile(r'SSL (.+)$')),
+    'AUTOBIND': ('autobind', re.compile(r'AUTOBIND dn="(.*)"')),
+}
+opline_parsers = {
+    'BIND': (BindReq, re.compile(r'BIND dn="(.*)" method=(\S+) version=\d ?(?:mech=(\S+))?')),
+    'ADD': (AddReq, re.compile(r'ADD dn="(.*)" (?:authzid=".*")?')),
+    'MOD': (ModReq, re.compile(r'MOD dn="(.*)" (?:authzid=".*")?')),
+    'MODRDN': (MdnReq, re.compile(r'MODRDN dn="(.*)" newrdn="(.+)" newsuperior="(.*)"')),
+    'DEL': (DelReq, re.compile(r'DEL dn="(.*)" (?:authzid=".*")?')),
+    'SRCH': (SrchReq, re.compile(r'SRCH base="(.*)" scope=(%s) filter="(.*)" attrs=(?:(ALL)|"(.*)")' % regex_num)),
+    'UNBIND': (UnbindReq, re.compile(r'UNBIND')),
+    'fd': (ClosedRes, re.compile(r'fd=%s closed' % regex_num)),
+    'ABANDON': (AbandonRes, re.compile(r'ABANDON targetop=(\S+) msgid=(%s) nentries=(%s) etime=(%s)' % (regex_num, regex_num, regex_num))),
+}
+regex_result = re.compile(r'RESULT err=(%s) tag=(\d+) ' % regex_num)
+regex_nentries = re.compile(r'nentries=(%s) ' % regex_num)
+# RESULT tags of the ops we replay - search results also have nentries
+result_tags = ('97', '103', '105', '107', '109')
+
+def classifyAccessLine(line):
+    """Match the [ts] conn=N op=M prefix of an access log line once, then
+    only the pattern for the keyword that follows it (BIND, SRCH, RESULT
+    etc.) instead of trying every regex_* pattern in turn.  Return
+    (kind, groups) - kind is the Req or Res class of an op line, or 'conn',
+    'ssl' or 'autobind' for a connection line, and groups are what the
+    regex_* pattern for the line would return - or (None, None) for a line
+    that is not replayed."""
+    match = regex_prefix.match(line)
+    if not match:
+        return (None, None)
+    ts, connid, opnum = match.groups()
+    pos = match.end()
+    end = line.find(' ', pos)
+    if end < 0:
+        keyword = line[pos:].rstrip()
+    else:
+        keyword = line[pos:end]
+    if keyword.startswith('fd='):
+        keyword = 'fd'
+    if not opnum:
+        kind, rx = connline_parsers.get(keyword, (None, None))
+        if not kind:
+            return (None, None)
+        match = rx.match(line.rstrip('\n'), pos)
+        if not match:
+            return (None, None)
+        if kind == 'ssl':
+            return (kind, (connid,) + match.groups())
+        return (kind, (ts, connid) + match.groups())
+    if keyword == 'RESULT':
+        match = regex_result.match(line, pos)
+        if not match:
+            return (None, None)
+        errnum, tag = match.groups()
+        if tag == '101':
+            match = regex_nentries.match(line, match.end())
+            if not match:
+                return (None, None)
+            return (SrchRes, (ts, connid, opnum, errnum) + match.groups())
+        if tag in result_tags:
+            return (Res, (ts, connid, opnum, errnum))
+        return (None, None)
+    kind, rx = opline_parsers.get(keyword, (None, None))
+    if not kind:
+        return (None, None)
+    match = rx.match(line, pos)
+    if not match:
+        return (None, None)
+    return (kind, (ts, connid, opnum) + match.groups())
+
+def classifyAccessLineRegex(line):
+    """classifyAccessLine the old way, by trying each regex_* pattern in
+    turn - for checking and benchmarking classifyAccessLine"""
+    for rx, kind in ((regex_new_conn, 'conn'), (regex_sslinfo, 'ssl'),
+                     (regex_ssl_map_fail, 'ssl'), (regex_autobind, 'autobind')):
+        match = rx.match(line)
+        if match:
+            return (kind, match.groups())
+    for rx,clz in regexmap:
+        match = rx.match(line)
+        if match:
+            return (clz, match.groups())
+    return (None, None)
+
 def parseAccessLine(line, begints, endts):
+    kind, groups = classifyAccessLine(line)
+    if not kind:
+        return True # no match
+
     # is this a new conn line?
-    match = regex_new_conn.match(line)
-    if match:
-        (timestamp, connid, fdid, slotid, ip) = match.groups()
+    if kind == 'conn':
+        (timestamp, connid, fdid, slotid, ip) = groups
         conn = Conn(timestamp, connid, fdid, slotid, ip)
         if not tsinrange(conn.ts, begints, endts): return False
         updateminmaxts(conn.ts)
-        connsbyts.setdefault(conn.ts, []).append(conn)
-        conns.setdefault(connid, []).append(conn)
-        return True
-
-    # is this an SSL info line?
-    match = regex_sslinfo.match(line)
-    if match:
-        (connid, sslinfo) = match.groups()
-        if connid in conns:
-            conns[connid][-1].addssl(sslinfo)
+        if stream_mode:
+            retiredconns.pop(connid, None)
+            # conn id reused after a restart - the old one is not coming back
+            for oldconn in conns.get(connid, [])[:]:
+                retireConn(oldconn)
         else:
-            raise Exception("ERROR: sslinfo " + sslinfo + " for " + connid + " but conn not found")
+            connsbyts.setdefault(conn.ts, []).append(conn)
+        conns.setdefault(connid, []).append(conn)
         return True
 
-    # is this a line with extra SSL mapping info?
-    match = regex_ssl_map_fail.match(line)
-    if match:
-        (connid, sslinfo) = match.groups()
+    # is this an SSL info line, or a line with extra SSL mapping info?
+    if kind == 'ssl':
+        (connid, sslinfo) = groups
         if connid in conns:
             conns[connid][-1].addssl(sslinfo)
         else:
@@ -749,42 +996,98 @@ def parseAccessLine(line, begints, endts):
         return True
 
     # autobind
-    match = regex_autobind.match(line)
-    if match:
-        (timestamp, connid, sslinfo) = match.groups()
+    if kind == 'autobind':
+        (timestamp, connid, sslinfo) = groups
         if connid in conns:
             conns[connid][-1].autobind = True
         else:
             raise Exception("ERROR: autobind for " + connid + " but conn not found")
         return True
 
-    for rx,clz in regexmap:
-        match = rx.match(line)
-        if match:
-            obj = clz(match=match)
-            if not tsinrange(obj.ts, begints, endts): return False
-            updateminmaxts(obj.ts)
-            # should have seen new conn line - if not, have to create a dummy one
-            connlist = conns.get(obj.conn, None)
-            if obj.conn in conns:
-                conn = conns[obj.conn][-1]
-            else:
-                conn = Conn(None, obj.conn, '', '', 'unknown')
-                conns[obj.conn] = [conn]
-                connsbyts.setdefault(0, []).append(conn)
-            if isinstance(obj, Req):
-                isclosed = conn.addreq(obj)
+    obj = kind(match=LineMatch(groups))
+    if not tsinrange(obj.ts, begints, endts): return False
+    updateminmaxts(obj.ts)
+    if stream_mode and obj.ts >= nextsweep:
+        sweepConns(obj.ts)
+    # should have seen new conn line - if not, have to create a dummy one
+    if obj.conn in conns:
+        conn = conns[obj.conn][-1]
+    elif stream_mode and obj.conn in retiredconns:
+        if isinstance(obj, ClosedRes):
+            del retiredconns[obj.conn]
+        return True # retired at its UNBIND
+    elif stream_mode and isinstance(obj, ClosedRes):
+        return True # already retired, or opened before the log started
+    else:
+        conn = Conn(None, obj.conn, '', '', 'unknown')
+        conns[obj.conn] = [conn]
+        if not stream_mode:
+            connsbyts.setdefault(0, []).append(conn)
+    if isinstance(obj, Req):
+        isclosed = conn.addreq(obj)
+    else:
+        isclosed = conn.addres(obj)
+    if stream_mode and (isinstance(obj, ClosedRes) or
+                        (isinstance(obj, UnbindReq) and not conn.ld)):
+        retireConn(conn)
+        if isinstance(obj, UnbindReq):
+            retiredconns[obj.conn] = obj.ts
+    elif isclosed: # unbind or closure
+        if conn.ld:
+            conn = conns.pop(obj.conn) # remove it
+        if conn.ld:
+            conn.ld.unbind_s()
+            conn.ld = None
+    return True
+
+def retireConn(conn):
+    """stream_mode - forget a conn that has been closed, keeping only its
+    bind in bindsbyts"""
+    connlist = conns.get(conn.conn, [])
+    if conn in connlist:
+        connlist.remove(conn)
+        if not connlist:
+            del conns[conn.conn]
+    if conn.binddn:
+        counts = bindsbyts.setdefault(conn.ts, {})
+        counts[conn.binddn] = counts.get(conn.binddn, 0) + 1
+    streamstats['conns'] += 1
+    for op in conn.ops.itervalues():
+        # UNBIND and closed have no result/request of their own
+        if not isinstance(op.req, UnbindReq) and not isinstance(op.res, ClosedRes):
+            streamstats['incomplete'] += 1
+    if conn.ld:
+        conn.ld.unbind_s()
+        conn.ld = None
+
+def sweepConns(now):
+    """stream_mode - evict the ops that have been incomplete for longer
+    than stale_op_timeout, every tenth of stale_op_timeout of log time"""
+    global nextsweep
+    nextsweep = now + max(stale_op_timeout / 10, 1)
+    nops = 0
+    nconns = 0
+    for connlist in conns.values():
+        for conn in connlist[:]:
+            if conn.evictops(now - stale_op_timeout):
+                retireConn(conn)
             else:
-                isclosed = conn.addres(obj)
-            if isclosed: # unbind or closure
-                if conn.ld:
-                    conn = conns.pop(obj.conn) # remove it
-                if conn.ld:
-                    conn.ld.unbind_s()
-                    conn.ld = None
-            return True
-
-    return True # no match
+                nops += len(conn.ops)
+                nconns += 1
+    for connid, ts in retiredconns.items():
+        if ts < now - stale_op_timeout:
+            del retiredconns[connid]
+    streamstats['maxconns'] = max(streamstats['maxconns'], nconns)
+    streamstats['maxops'] = max(streamstats['maxops'], nops)
+
+def finishStream():
+    """stream_mode - retire the conns still open at the end of the logs"""
+    for connlist in conns.values():
+        for conn in connlist[:]:
+            retireConn(conn)
+    print "Retired %(conns)d conns (at most %(maxconns)d open at once) - %(ops)d complete ops, " \
+          "%(evicted)d stale ops evicted, %(incomplete)d ops incomplete when their conn closed, " \
+          "at most %(maxops)d ops in progress" % streamstats
 
 def parseAccess(f, startoff, endoff, begints, endts):
     lineno = 0
@@ -794,6 +1097,227 @@ def parseAccess(f, startoff, endoff, begints, endts):
             if (lineno % 10000) == 0: print "Line", lineno
             parseAccessLine(line, begints, endts)
 
+# size of the pieces parallelParseAccess splits uncompressed access logs into
+ACCESS_CHUNK_SIZE = 32 * 1024 * 1024
+
+class ConnSegment(object):
+    """What parseAccessChunk found out about one conn in one chunk of an
+    access log - opened is True if the chunk has its connection line,
+    otherwise the segment continues the conn with that id in the chunks
+    before it.  ops has the op ids whose request ('req') or result ('res')
+    has been seen without the other one."""
+    def __init__(self, conn, ts=0, opened=False):
+        self.conn = conn
+        self.ts = ts
+        self.opened = opened
+        self.closed = False
+        self.binddn = None
+        self.ops = {}
+        self.ncomplete = 0
+    def addop(self, opid, half):
+        if self.ops.get(opid, half) != half:
+            del self.ops[opid]
+            self.ncomplete += 1
+        else:
+            self.ops[opid] = half
+    def merge(self, oth):
+        """add the segment after this one of the same conn"""
+        if oth.binddn:
+            self.binddn = oth.binddn
+        self.closed = oth.closed
+        self.ncomplete += oth.ncomplete
+        for opid, half in oth.ops.iteritems():
+            self.addop(opid, half)
+
+def accessChunks(filename, chunksize=ACCESS_CHUNK_SIZE):
+    """Split an access log into (filename, start, end) byte ranges of about
+    chunksize bytes which end at the end of a line - a compressed log is
+    one range, (filename, 0, None), since it cannot be read from the middle"""
+    fp = openInput(filename)
+    if not isinstance(fp, file):
+        fp.close()
+        return [(filename, 0, None)]
+    size = os.path.getsize(filename)
+    chunks = []
+    start = 0
+    while start < size:
+        end = start + chunksize
+        if end >= size:
+            end = size
+        else:
+            fp.seek(end)
+            fp.readline()  # finish the partial line
+            end = fp.tell()
+        chunks.append((filename, start, end))
+        start = end
+    fp.close()
+    return chunks
+
+def parseAccessChunk(args):
+    """Parse one range of an access log from accessChunks - this runs in
+    the worker processes of parallelParseAccess, so it must be a module
+    level function.  Return the ConnSegments in the order their conns were
+    first seen, the number of BINDs by bind dn, the min and max ts, and the
+    number of lines."""
+    filename, start, end, begints, endts = args
+    if end is None:
+        fp = openInput(filename)
+        lines = fp
+    else:
+        fp = open(filename, 'rb')
+        fp.seek(start)
+        lines = fp.read(end - start).split('\n')
+        if lines and not lines[-1]:
+            lines.pop()
+    segs = []
+    cursegs = {}
+    binds = {}
+    mymints, mymaxts = (sys.maxint, 0)
+    nlines = 0
+    for line in lines:
+        nlines += 1
+        kind, groups = classifyAccessLine(line)
+        if not kind or kind == 'ssl' or kind == 'autobind':
+            continue
+        ts = accesstime2ts(groups[0])
+        if not tsinrange(ts, begints, endts): continue
+        mymints, mymaxts = (min(mymints, ts), max(mymaxts, ts))
+        connid = groups[1]
+        if kind == 'conn':
+            seg = ConnSegment(connid, ts, True)
+            cursegs[connid] = seg
+            segs.append(seg)
+            continue
+        seg = cursegs.get(connid, None)
+        if not seg:
+            seg = ConnSegment(connid)
+            cursegs[connid] = seg
+            segs.append(seg)
+        if kind == BindReq:
+            seg.binddn = groups[3]
+            binds[seg.binddn] = binds.get(seg.binddn, 0) + 1
+        # UNBIND and closed are not counted as ops
+        if kind == ClosedRes:
+            seg.closed = True
+            del cursegs[connid]
+        elif kind == UnbindReq:
+            pass
+        elif kind == AbandonRes and groups[3].isdigit():
+            # if an op is abandoned, the abandon is the "result"
+            seg.addop('op=' + groups[3], 'res')
+        elif issubclass(kind, Req):
+            seg.addop(groups[2], 'req')
+        else:
+            seg.addop(groups[2], 'res')
+    fp.close()
+    return segs, binds, mymints, mymaxts, nlines
+
+def parallelParseAccess(filenames, begints=0, endts=sys.maxint, processes=None,
+                        chunksize=ACCESS_CHUNK_SIZE):
+    """Parse the access logs filenames, in order, with a pool of processes
+    for the bind stats.  The files are split by accessChunks, and each
+    chunk is parsed by parseAccessChunk in a worker.  The ConnSegments are
+    stitched together here in log order - a segment that is not opened
+    continues the last conn with the same id, even if that conn was opened
+    in an earlier chunk or file - and each conn is added to bindsbyts when
+    it is closed, as retireConn does.  At most two chunks per process are
+    in flight.  processes defaults to the number of CPUs - without the
+    multiprocessing module, or with processes=1, the chunks are parsed in
+    this process."""
+    global mints, maxts
+    work = [(filename, start, end, begints, endts)
+            for filename in filenames
+            for (filename, start, end) in accessChunks(filename, chunksize)]
+    if not HASMP or processes == 1:
+        results = (parseAccessChunk(args) for args in work)
+    else:
+        if not processes:
+            processes = multiprocessing.cpu_count()
+        results = parallelResults(work, processes)
+    opensegs = {}
+    nlines = 0
+    def retire(seg):
+        if seg.binddn:
+            counts = bindsbyts.setdefault(seg.ts, {})
+            counts[seg.binddn] = counts.get(seg.binddn, 0) + 1
+        streamstats['conns'] += 1
+        streamstats['ops'] += seg.ncomplete
+        streamstats['incomplete'] += len(seg.ops)
+    for segs, binds, mymints, mymaxts, mylines in results:
+        nlines += mylines
+        if mymaxts:
+            updateminmaxts(mymints)
+            updateminmaxts(mymaxts)
+        for dn, count in binds.iteritems():
+            binddns[dn] = binddns.get(dn, 0) + count
+        for seg in segs:
+            if seg.opened or seg.conn not in opensegs:
+                if seg.conn in opensegs:  # conn id reused after a restart
+                    retire(opensegs[seg.conn])
+                opensegs[seg.conn] = seg
+            else:
+                opensegs[seg.conn].merge(seg)
+            if seg.closed:
+                retire(opensegs.pop(seg.conn))
+        streamstats['maxconns'] = max(streamstats['maxconns'], len(opensegs))
+    for seg in opensegs.values():
+        retire(seg)
+    print "Parsed %d lines in %d chunks" % (nlines, len(work))
+    print "%(conns)d conns (at most %(maxconns)d open between chunks) - %(ops)d complete ops, " \
+          "%(incomplete)d ops incomplete" % streamstats
+
+def parallelResults(work, processes):
+    """yield parseAccessChunk of each of work, in order, from a pool of
+    processes"""
+    pool = multiprocessing.Pool(processes)
+    pending = deque()
+    todo = iter(work)
+    try:
+        while True:
+            while len(pending) < 2 * processes:
+                try:
+                    args = todo.next()
+                except StopIteration:
+                    break
+                pending.append(pool.apply_async(parseAccessChunk, (args,)))
+            if not pending:
+                break
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        # an error, or the caller stopped iterating (GeneratorExit) - let
+        # the chunks in flight finish first, terminate can deadlock on a
+        # worker that is writing a large result
+        for res in pending:
+            res.wait()
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+def benchAccess(f, maxlines=1000000):
+    """time classifyAccessLine against classifyAccessLineRegex on the first
+    maxlines lines of f and check that they agree"""
+    lines = []
+    for line in f:
+        lines.append(line)
+        if len(lines) >= maxlines: break
+    results = []
+    for func in (classifyAccessLineRegex, classifyAccessLine):
+        start = time.time()
+        res = [func(line) for line in lines]
+        elapsed = max(time.time() - start, 1e-6)
+        print "%s: %d lines in %.3f seconds - %.0f lines/sec" % (
+            func.__name__, len(lines), elapsed, len(lines) / elapsed)
+        results.append(res)
+    ndiff = 0
+    for line, old, new in zip(lines, results[0], results[1]):
+        if old != new:
+            ndiff += 1
+            if ndiff <= 10:
+                print "Error: classified differently:", line.rstrip(), old, new
+    print "%d lines classified differently" % ndiff
+
 def getBindStats():
     # now let's find all of the binddns that exceeded the threshold
     thresh = int(os.environ.get('THRESH', 1000))
@@ -804,15 +1328,17 @@ def getBindStats():
     # print column header
     print "timestamp" + delim + delim.join(usebinddns) + delim + "ALL"
         
+    if not stream_mode:
+        for ts, connlist in connsbyts.iteritems():
+            for conn in connlist:
+                if not conn.binddn: continue # conn terminated before bind
+                counts = bindsbyts.setdefault(ts, {})
+                counts[conn.binddn] = counts.get(conn.binddn, 0) + 1
+
     for ts in xrange(mints, maxts+1):
-        if not ts in connsbyts: continue # no data for this time
-        binddn2cnt = {}
-        allconn = 0
-        for conn in connsbyts[ts]:
-            if not conn.binddn: continue # conn terminated before bind
-            val = binddn2cnt.get(conn.binddn, 0) + 1
-            binddn2cnt[conn.binddn] = val
-            allconn += 1
+        if not ts in bindsbyts: continue # no data for this time
+        binddn2cnt = bindsbyts[ts]
+        allconn = sum(binddn2cnt.values())
         # now have conn/sec by binddn
         outstr = str(ts)
         for dn in usebinddns:
@@ -823,8 +1349,8 @@ def getBindStats():
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
-    parser.add_argument('-c', '--access', nargs='+', type=file, help='access log files - will be parsed in the order given')
-    parser.add_argument('-u', '--audit', nargs='+', type=file, help='audit log files - will be parsed in the order given')
+    parser.add_argument('-c', '--access', nargs='+', type=openInput, help='access log files - will be parsed in the order given')
+    parser.add_argument('-u', '--audit', nargs='+', type=openInput, help='audit log files - will be parsed in the order given')
     parser.add_argument('-b', '--accessbegin', type=int, help='beginning access log line', default=0)
     parser.add_argument('-e', '--accessend', type=int, help='ending access log line', default=sys.maxint)
     parser.add_argument('-s', '--auditstart', type=int, help='starting audit log record number', default=0)
@@ -833,7 +1359,21 @@ if __name__ == '__main__':
     parser.add_argument('--accesstimeend', type=str, help='ending access log time', default='')
     parser.add_argument('-v', action='count', help='repeat for more verbosity', default=0)
     parser.add_argument('--clldif', action='store_true', help='is audit output from cl-ldif?')
+    parser.add_argument('--auditzone', type=str, help='zone of the audit log times e.g. -0600 - default is the zone of the first access log, or the local zone')
+    parser.add_argument('--bench', action='store_true', help='benchmark access log line classification and exit')
+    parser.add_argument('--stream', action='store_true', help='keep only the conns and ops in progress, for very large logs')
+    parser.add_argument('--optimeout', type=int, help='with --stream, forget incomplete ops after this many seconds', default=stale_op_timeout)
+    parser.add_argument('--bindstats', action='store_true', help='print the number of connections per second by bind DN')
+    parser.add_argument('-j', '--jobs', type=int, help='parse the access logs for bind stats with this many processes (0 - one per CPU) instead of replaying them - implies --bindstats')
     args = parser.parse_args()
+    stream_mode = args.stream
+    stale_op_timeout = args.optimeout
+
+    if args.bench:
+        for f in args.access or []:
+            print "Benchmarking file", f.name
+            benchAccess(f)
+        sys.exit(0)
 
     if (not args.access or len(args.access) == 0) and (not args.audit or len(args.audit) == 0):
         print "Error: no audit or access logs given"
@@ -848,6 +1388,13 @@ if __name__ == '__main__':
     else:
         endts = sys.maxint
 
+    # audit log times have no zone - convert them with the same zone as the
+    # access log, so that findAuditReq can match them
+    if args.auditzone:
+        audit_zone_offset = parsezone(args.auditzone)
+    elif args.audit and args.access and args.access[0].name != '<stdin>':
+        audit_zone_offset = accesslogzone(args.access[0].name)
+
     if args.audit:
         for ii in xrange(0, len(args.audit)):
             start, finish = (0, sys.maxint)
@@ -868,15 +1415,35 @@ if __name__ == '__main__':
                 conn.addres(Res(op.ts, '0', str(opid), '0'))
                 opid += 1
 
+    if args.jobs is not None:
+        if os.environ.get('LDAPURL', None) or args.accessbegin or args.accessend != sys.maxint:
+            print "Error: -j cannot be used with LDAPURL, -b or -e"
+            sys.exit(1)
+        if not args.access:
+            print "Error: -j needs access logs"
+            sys.exit(1)
+        if sys.stdin in args.access:
+            print "Error: -j cannot read the access log from stdin"
+            sys.exit(1)
+        args.bindstats = True
+        # the workers open the files by name, and read them in chunks
+        names = [f.name for f in args.access]
+        for f in args.access:
+            f.close()
+        # fills in bindsbyts for getBindStats
+        parallelParseAccess(names, begints, endts, args.jobs or None)
+        naccess = 0
+
     for ii in xrange(0, naccess):
         print "Analyzing file", args.access[ii].name
         begin, end = (0, sys.maxint)
         if ii == 0: begin = args.accessbegin
         if ii == naccess-1: end = args.accessend
         parseAccess(args.access[ii], begin, end, begints, endts)
+    if stream_mode:
+        finishStream()
 
-    bindstats = False
-    if bindstats:
+    if args.bindstats:
         getBindStats()
 
     opsinprogress = False
@@ -887,7 +1454,7 @@ if __name__ == '__main__':
                 if not conn.ops:
                     print "Connection opened at", conn.timestamp, "from IP", conn.ip
                     continue
-                for op in conn.ops:
+                for op in conn.pendingops():
                     if op.req and op.res: continue # op completed
                     if op.res:
                         print "Connection with result but no request", str(op.res)
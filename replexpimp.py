@@ -4,7 +4,8 @@ import sys
 import time
 import ldap
 import ldif
-from dsadmin import DSAdmin, Entry
+from dsadmin import DSAdmin, Entry, LDIFPipeline
+from dsadmin_utils import normalizeDN
 
 host1 = "localhost.localdomain"
 port1 = 1200
@@ -36,67 +37,38 @@ benames.append(ents[0].cn)
 fixfile = "%s/100k.ldif" % os.environ.get('PREFIX', '/usr')
 initfiles = [fixfile.replace("100k", bename) for bename in benames]
 
-class AddEntriesForSuffix(ldif.LDIFParser):
-    def __init__(
-        self,
-        input_file,output_files,basedns,
-        ignored_attr_types=None,max_entries=0,process_url_schemes=None,
-        base64_attrs=None,cols=76,line_sep='\n'
-    ):
-        """
-        See LDIFParser.__init__()
-        
-        Additional Parameters:
-        all_records
-        List instance for storing parsed records
-        """
-        myfile = input_file
-        if isinstance(input_file,basestring):
-            myfile = open(input_file, "r")
-        ldif.LDIFParser.__init__(self,myfile,ignored_attr_types,max_entries,process_url_schemes)
-
-        self.outfiles = []
-        self.outldifs = []
-        for output_file in output_files:
-            if isinstance(output_file,basestring):
-                outfile = open(output_file, "w")
-            self.outfiles.append(outfile)
-            self.outldifs.append(ldif.LDIFWriter(outfile,base64_attrs,cols,line_sep))
-        self.basedns = basedns
-        self.iterlist = zip(self.basedns, self.outldifs)
-        self.iterlist.reverse()
-        
-        self.parse()
-        if isinstance(input_file,basestring):
-            myfile.close()
-
-        for (fn, fd) in zip(output_files, self.outfiles):
-            if isinstance(fn,basestring):
-                fd.close()
-
-    def handle(self,dn,entry):
-        """
-        assumes basedns[0] is the parent, basedns[1] already exists,
-        and we want to create entries for basedns[2]
-        """
-        normdn = DSAdmin.normalizeDN(dn)
-        for (basedn, ld) in self.iterlist:
+def addEntriesForSuffix(input_file, output_files, basedns):
+    """
+    split input_file into one file per basedn - assumes basedns[0] is the
+    parent, basedns[1] already exists, and we want to create entries for
+    basedns[2] by copying the ones under basedns[1]
+    """
+    bases = list(basedns)
+    bases.reverse() # most specific first
+    def bysuffix(dn, entry):
+        normdn = normalizeDN(dn)
+        for basedn in bases:
             if normdn.endswith(basedn):
-                ld.unparse(dn,entry)
-                if basedn == self.basedns[1]:
-                    dn = normdn.replace(basedn,self.basedns[2])
-                    for (attr, vals) in entry.iteritems():
-                        for ii in xrange(0, len(vals)):
-                            vals[ii] = vals[ii].replace(basedn,self.basedns[2])
-                    self.outldifs[2].unparse(dn,entry)
-                break
+                return basedn
+        return None
+    def copyentries(dn, entry):
+        normdn = normalizeDN(dn)
+        if bysuffix(dn, entry) != basedns[1]:
+            return (dn, entry)
+        newentry = {}
+        for (attr, vals) in entry.iteritems():
+            newentry[attr] = [val.replace(basedns[1], basedns[2]) for val in vals]
+        return [(dn, entry), (normdn.replace(basedns[1], basedns[2]), newentry)]
+    pipe = LDIFPipeline(input_file)
+    pipe.map(copyentries)
+    pipe.partition(bysuffix, dict(zip(basedns, output_files)), 76)
+    pipe.run()
 
 neednewfile = False
 if neednewfile:
-    aefs = AddEntriesForSuffix(fixfile, initfiles, basedns)
+    addEntriesForSuffix(fixfile, initfiles, basedns)
 
-for (fn, bename) in zip(initfiles, benames):
-    srv.importLDIF(fn, '', bename, True)
+srv.importLDIFs(zip(benames, initfiles), len(benames), True)
 
 print "change the cache size to the minimum"
 mod = [(ldap.MOD_REPLACE, "nsslapd-cachememsize", "512000"),
@@ -2,7 +2,9 @@ import os
 import sys
 import time
 import ldap
-from dsadmin import DSAdmin, Entry
+import json
+import csv
+from dsadmin import DSAdmin, Entry, RUV, RUV_FILTER, RUV_ATTRS, DN_MAPPING_TREE
 from dsadmin_utils import normalizeDN
 from argparse import ArgumentParser
 
@@ -11,7 +13,9 @@ parser.add_argument('-H', nargs='+', help='host:port')
 parser.add_argument('-D', nargs='+', help='binddns')
 parser.add_argument('-w', nargs='+', help='bindpws')
 parser.add_argument('-b', nargs='+', help='suffixes')
-parser.add_argument('-t', type=int, help='time for sleep in seconds', default=30)
+parser.add_argument('-t', type=float, help='time between polls in seconds', default=30)
+parser.add_argument('-o', help='append the lag and rate time series to this file')
+parser.add_argument('-f', choices=('csv', 'json'), help='format of the -o file (default from its extension)')
 parser.add_argument('-v', action='count', help='repeat for more verbosity', default=0)
 args = parser.parse_args()
 
@@ -57,8 +61,87 @@ for ii in range(0, len(args.H)):
 #            raise Exception("error: server " + str(conn) + " has no agreements for suffix " + suf)
             print("error: server " + str(conn) + " has no agreements for suffix " + suf + " probably a consumer")
         suffixes[normalizeDN(suf)] = suf
-        for agmt in agmts:
-            conn.lastnumchanges[agmt] = 0
+
+out = None
+writer = None
+fmt = args.f
+if args.o:
+    out = open(args.o, 'a')
+    if not fmt:
+        fmt = 'csv'
+        if args.o.endswith('.json'):
+            fmt = 'json'
+    if fmt == 'csv':
+        writer = csv.writer(out, lineterminator='\n')
+        if not out.tell():
+            writer.writerow(['time', 'suffix', 'kind', 'from', 'to', 'value'])
+
+
+def poll(conns, suffixes):
+    """Read the RUV of each suffix and the agreements of every server at
+    the same time - all of the searches are sent before any of the results
+    are read.  Return the time of the poll, a dict of suffix -> list of
+    RUV (or None) in the order of conns, and a list of the agreement
+    entries of each server."""
+    now = time.time()
+    ruvids = []
+    agmtids = []
+    for conn in conns:
+        ruvids.append([(suf, conn.search_ext(suf, ldap.SCOPE_SUBTREE, RUV_FILTER, RUV_ATTRS))
+                       for suf in suffixes])
+        agmtids.append(conn.search_ext(DN_MAPPING_TREE, ldap.SCOPE_SUBTREE,
+                                       "(objectclass=nsds5ReplicationAgreement)",
+                                       ['nsds5replicaroot', 'nsds5replicaChangesSentSinceStartup']))
+    ruvs = dict([(suf, []) for suf in suffixes])
+    agmts = []
+    for conn, msgids, agmtid in zip(conns, ruvids, agmtids):
+        for suf, msgid in msgids:
+            try:
+                rtype, ents = conn.result(msgid)
+            except ldap.NO_SUCH_OBJECT:
+                ents = []
+            ruv = None
+            if ents:
+                ruv = RUV(ents[0])
+            ruvs[suf].append(ruv)
+        rtype, ents = conn.result(agmtid)
+        agmts.append(ents or [])
+    return now, ruvs, agmts
+
+
+def record(now, suf, kind, src, dest, value):
+    """append a lag or rate sample to the -o file - suf is the suffix as
+    given in suffixes, so that the lag and rate rows can be joined"""
+    if not out:
+        return
+    if fmt == 'json':
+        out.write(json.dumps({'time': now, 'suffix': suf, 'kind': kind,
+                              'from': src, 'to': dest, 'value': value}) + "\n")
+    else:
+        if value is None:
+            value = ''
+        writer.writerow(['%.3f' % now, suf, kind, src, dest, value])
+
+
+def printmatrix(suf, ruvs):
+    """print the N x N matrix of how many seconds the server in each
+    column is behind the server in each row, and return it"""
+    names = [str(conn) for conn in conns]
+    width = max([len(name) for name in names] + [6])
+    print "Lag in seconds for suffix %s (column is behind row by)" % suf
+    print "%-*s %s" % (width, '', ' '.join(['%*s' % (width, name) for name in names]))
+    matrix = []
+    for ruv1, name in zip(ruvs, names):
+        row = []
+        for ruv2 in ruvs:
+            lag = None
+            if ruv1 and ruv2:
+                lag = ruv1.maxlag(ruv2)
+            row.append(lag)
+        matrix.append(row)
+        print "%-*s %s" % (width, name, ' '.join(
+            ['%*s' % (width, lag is None and '-' or lag) for lag in row]))
+    return matrix
 
 sleeptime = args.t # seconds
 print "Press Enter when the update is started"
@@ -67,18 +150,26 @@ for conn in conns:
     for suf in suffixes.values():
         conn.starttime[suf] = int(time.time())
 
+lastpoll = None
 running = True
 while running:
     notconverged = 0
+    now, ruvs, agmts = poll(conns, suffixes.values())
     for suf in suffixes.values():
-        if not running: break
+        matrix = printmatrix(suf, ruvs[suf])
+        for ii, row in enumerate(matrix):
+            for jj, lag in enumerate(row):
+                if ii != jj:
+                    record(now, suf, 'lag', str(conns[ii]), str(conns[jj]), lag)
+        ruv1 = ruvs[suf][0]
+        srv1 = conns[0]
         for ii in range(1, len(conns)):
-            if not running: break
-            srv1 = conns[0]
             srv2 = conns[ii]
-            ruv1 = srv1.getRUV(suf)
-            ruv2 = srv2.getRUV(suf)
-            rc, status = ruv1.getdiffs(ruv2)
+            ruv2 = ruvs[suf][ii]
+            if not ruv1 or not ruv2:
+                rc, status = 1, "\tcould not read RUV"
+            else:
+                rc, status = ruv1.getdiffs(ruv2)
             print "For suffix %s server1 %s server2 %s" % (suf, str(srv1), str(srv2))
             print status
             if args.v > 0:
@@ -99,27 +190,42 @@ while running:
     if notconverged == 0: # all are converged
         running = False
         break
-    for srv in conns:
-        if not running: break
-        for agmtdn in srv.lastnumchanges.keys():
-            if not running: break
-#            print srv.getReplStatus(agmtdn)
-            numchanges = srv.getChangesSent(agmtdn)
-            if numchanges:
-                if not srv.lastnumchanges[agmtdn]:
-                    srv.lastnumchanges[agmtdn] = numchanges
-                diff = numchanges - srv.lastnumchanges[agmtdn]
-                rate = diff*2
-                avgrate = 0
-                if rate > 0:
-                    ii = srv.count.get(agmtdn, 0)
-                    avgrate = ((ii * srv.avgrate.get(agmtdn, 0)) + rate) / (ii + 1)
-                    srv.avgrate[agmtdn] = avgrate
-                    srv.count[agmtdn] = ii + 1
-                print "Agreement from", str(srv), agmtdn, "changes sent", numchanges, "current rate is", rate, "average rate is", avgrate
+    for srv, ents in zip(conns, agmts):
+        for ent in ents:
+            nsuf = normalizeDN(ent.nsds5replicaroot or '')
+            if nsuf not in suffixes:
+                continue
+            agmtdn = ent.dn
+            numchanges = DSAdmin.parseChangesSent(ent.nsds5replicaChangesSentSinceStartup)
+            if not numchanges:
+                continue
+            if agmtdn not in srv.lastnumchanges or not lastpoll:
                 srv.lastnumchanges[agmtdn] = numchanges
-    time.sleep(sleeptime)
+            diff = numchanges - srv.lastnumchanges[agmtdn]
+            # changes per second over the real time since the last poll
+            rate = 0.0
+            if lastpoll and now > lastpoll:
+                rate = diff / (now - lastpoll)
+            avgrate = 0
+            if rate > 0:
+                ii = srv.count.get(agmtdn, 0)
+                avgrate = ((ii * srv.avgrate.get(agmtdn, 0)) + rate) / (ii + 1)
+                srv.avgrate[agmtdn] = avgrate
+                srv.count[agmtdn] = ii + 1
+            print "Agreement from %s %s changes sent %d current rate is %.1f/sec average rate is %.1f/sec" % (
+                str(srv), ent.cn, numchanges, rate, avgrate)
+            record(now, suffixes[nsuf], 'rate', str(srv), ent.cn, rate)
+            srv.lastnumchanges[agmtdn] = numchanges
+    lastpoll = now
+    if out:
+        out.flush()
+    # poll every sleeptime seconds, however long the poll took
+    delay = now + sleeptime - time.time()
+    if delay > 0:
+        time.sleep(delay)
 
+if out:
+    out.close()
 for suf in suffixes.values():
     for ii in range(1, len(conns)):
         conn = conns[ii]
@@ -25,6 +25,7 @@ Warnings and errors are written in stderr.
 
 import re
 import sys
+from fileutils import openInput
 
 class TextParser:
     """
@@ -336,7 +337,7 @@ class ValgrindParser(TextParser):
                 infile = input
             else: # assume filename
                 self.filename = input
-                infile = open(self.filename, "r")
+                infile = openInput(self.filename)
             TextParser.__init__(self, infile, self.searchLeakHeader)
             if not isinstance(input, file):
                 infile.close()            